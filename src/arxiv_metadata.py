@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sqlite3
+from tqdm import tqdm
+
+IMPORT_BATCH_SIZE = 10000
+LOOKUP_BATCH_SIZE = 500
+
+
+def import_snapshot(metadata_file, db_path):
+    """ Import the arXiv metadata snapshot (JSONL) into an SQLite table keyed by arXiv ID,
+        keeping only the fields used for extraction. The database is written to a temporary
+        file first, so an interrupted import does not leave a partial store behind.
+
+    Args:
+        metadata_file (string): Path to arxiv-metadata-oai-snapshot.json
+        db_path (string): Path to SQLite database
+
+    Returns:
+        int: Number of imported records
+    """
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(
+        "CREATE TABLE metadata (id TEXT PRIMARY KEY, abstract TEXT, versions TEXT, update_date TEXT)"
+    )
+
+    num_records = 0
+    rows = []
+    with open(metadata_file, "r") as f:
+        for line in tqdm(f, desc=f"Importing {metadata_file}"):
+            metadata = json.loads(line)
+            rows.append((
+                metadata["id"].replace("/", ""),
+                metadata["abstract"],
+                json.dumps(metadata.get("versions", [])),
+                metadata.get("update_date"),
+            ))
+            if len(rows) == IMPORT_BATCH_SIZE:
+                conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", rows)
+                num_records += len(rows)
+                rows = []
+    conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", rows)
+    num_records += len(rows)
+    conn.commit()
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    return num_records
+
+
+def lookup_metadata(db_path, id_list):
+    """ Get the metadata of the articles in id_list, in the same order. Articles missing
+        from the store are skipped.
+
+    Yields:
+        dict: Metadata with "id", "abstract", "versions" and "update_date" keys
+    """
+    conn = sqlite3.connect(db_path)
+    for i in range(0, len(id_list), LOOKUP_BATCH_SIZE):
+        batch = id_list[i: i+LOOKUP_BATCH_SIZE]
+        rows = conn.execute(
+            f"SELECT id, abstract, versions, update_date FROM metadata WHERE id IN ({','.join('?' * len(batch))})",
+            batch
+        ).fetchall()
+        metadata_by_id = {
+            arxiv_id: {
+                "id": arxiv_id, "abstract": abstract, "versions": json.loads(versions), "update_date": update_date
+            }
+            for arxiv_id, abstract, versions, update_date in rows
+        }
+        for arxiv_id in batch:
+            if arxiv_id in metadata_by_id:
+                yield metadata_by_id[arxiv_id]
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--metadata_file",
+        type=str,
+        required=True,
+        help="The arXiv metadata snapshot."
+    )
+    parser.add_argument(
+        "--metadata_db",
+        type=str,
+        required=True,
+        help="The SQLite database to create."
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Overwrite the database."
+    )
+
+    args = parser.parse_args()
+
+    if os.path.exists(args.metadata_db) and not args.overwrite:
+        raise ValueError(
+            f"Database ({args.metadata_db}) already exists. Use --overwrite to overcome."
+        )
+
+    num_records = import_snapshot(args.metadata_file, args.metadata_db)
+    print(f"Imported {num_records} records into {args.metadata_db}")
@@ -0,0 +1,216 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from multiprocessing.pool import ThreadPool
+from subprocess import PIPE
+
+ARXIV_BUCKET = "gs://arxiv-dataset"
+OLD_ID_PATTERN = re.compile(r"^([a-z\-]*)(\d{7})$")
+NEW_ID_PATTERN = re.compile(r"^(\d{4})\.(\d{4,5})$")
+PDF_NAME_PATTERN = re.compile(r"^(.+)v([0-9]+)\.pdf$")
+
+
+class StorageError(Exception):
+    pass
+
+
+class GcsStorage:
+    """ Google Cloud Storage bucket, accessed with gsutil. Paths are relative to the bucket """
+
+    def __init__(self, bucket=ARXIV_BUCKET):
+        self.bucket = bucket.rstrip("/")
+
+    def list(self, prefix):
+        """ List the objects whose path starts with prefix (a folder)
+
+        Returns:
+            list: Object paths
+
+        Raises:
+            StorageError: If the prefix could not be listed
+        """
+        p = subprocess.Popen(
+            ["gsutil", "-q", "ls", f"{self.bucket}/{prefix}"], stdin=PIPE, stdout=PIPE, stderr=PIPE
+        )
+        output, error = p.communicate()
+        if p.returncode != 0:
+            if b"matched no objects" in error:
+                return []
+            raise StorageError(f"Could not list {self.bucket}/{prefix}: {error.decode('utf-8').strip()}")
+        paths = output.decode("utf-8").split("\n")
+        return [path[len(self.bucket)+1:] for path in paths if path.startswith(self.bucket)]
+
+    def copy(self, path, output_path):
+        subprocess.call(["gsutil", "-q", "cp", f"{self.bucket}/{path}", output_path])
+        return os.path.exists(output_path)
+
+    def copy_many(self, pairs, num_workers=8):
+        """ Copy objects with a single multi-threaded gsutil transfer per round. Objects 
+            are downloaded to a temporary folder and then renamed, so objects sharing a 
+            file name (e.g. old IDs of different categories) go to separate rounds.
+
+        Args:
+            pairs (list): (object path, output path) tuples
+            num_workers (int): Number of concurrent transfers
+
+        Returns:
+            list: For each pair, True if the object has been copied, False otherwise
+        """
+        copied = [False] * len(pairs)
+        remaining = list(range(len(pairs)))
+        while remaining:
+            names = set()
+            current, remaining_next = [], []
+            for i in remaining:
+                name = os.path.basename(pairs[i][0])
+                (remaining_next if name in names else current).append(i)
+                names.add(name)
+
+            output_dirs = {os.path.dirname(os.path.abspath(pairs[i][1])) for i in current}
+            with tempfile.TemporaryDirectory(dir=sorted(output_dirs)[0]) as tmp_dir:
+                urls = "".join(f"{self.bucket}/{pairs[i][0]}\n" for i in current)
+                subprocess.run(
+                    [
+                        "gsutil", "-q", "-m", "-o", f"GSUtil:parallel_thread_count={num_workers}", 
+                        "-o", "GSUtil:parallel_process_count=1", "cp", "-I", tmp_dir,
+                    ],
+                    input=urls.encode("utf-8"),
+                    stdout=PIPE, 
+                    stderr=PIPE,
+                )
+                for i in current:
+                    tmp_path = os.path.join(tmp_dir, os.path.basename(pairs[i][0]))
+                    if os.path.exists(tmp_path):
+                        os.replace(tmp_path, pairs[i][1])
+                        copied[i] = True
+            remaining = remaining_next
+        return copied
+
+
+class LocalStorage:
+    """ Local folder standing in for a bucket, e.g. for tests and benchmarks """
+
+    def __init__(self, root):
+        self.root = root
+
+    def list(self, prefix):
+        folder = os.path.join(self.root, prefix)
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(prefix, fname) for fname in sorted(os.listdir(folder))]
+
+    def copy(self, path, output_path):
+        try:
+            shutil.copyfile(os.path.join(self.root, path), output_path)
+        except OSError:
+            return False
+        return True
+
+    def copy_many(self, pairs, num_workers=8):
+        with ThreadPool(num_workers) as pool:
+            return pool.starmap(self.copy, pairs)
+
+
+def get_storage(bucket):
+    """ Get a storage client for a gs:// bucket, or for a local folder with the same layout """
+    if bucket.startswith("gs://"):
+        return GcsStorage(bucket)
+    return LocalStorage(bucket)
+
+
+def get_pdf_prefix(arxiv_id):
+    """ Get the folder containing the PDFs of an article, and the name of its PDFs
+        without version, e.g. "2101.00001" -> ("arxiv/arxiv/pdf/2101/", "2101.00001")
+        and "astro-ph9702020" -> ("arxiv/astro-ph/pdf/9702/", "9702020")
+
+    Returns:
+        tuple: Folder and file name stem, or None if arxiv_id is not a valid identifier
+    """
+    m = OLD_ID_PATTERN.match(arxiv_id)
+    if m:
+        return f"arxiv/{m.group(1)}/pdf/{m.group(2)[:4]}/", m.group(2)
+    m = NEW_ID_PATTERN.match(arxiv_id)
+    if m:
+        return f"arxiv/arxiv/pdf/{m.group(1)}/", arxiv_id
+    return None
+
+
+def get_arxiv_id(prefix, stem):
+    """ Inverse of get_pdf_prefix """
+    category = prefix.split("/")[1]
+    return stem if category == "arxiv" else category + stem
+
+
+class ArxivManifest:
+    """ Local index of the latest version of each arXiv PDF
+
+    Each month prefix of the bucket is listed once, and kept in a JSON file so that
+    later runs only list prefixes they have not seen yet.
+
+    Args:
+        manifest_path (string): Path to JSON file
+        storage: Storage client (GcsStorage or LocalStorage)
+    """
+
+    def __init__(self, manifest_path, storage):
+        self.manifest_path = manifest_path
+        self.storage = storage
+        self.prefixes = set()
+        self.objects = {}
+        if manifest_path is not None and os.path.isfile(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            self.prefixes = set(manifest["prefixes"])
+            self.objects = manifest["objects"]
+
+    def save(self):
+        if self.manifest_path is None:
+            return
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"prefixes": sorted(self.prefixes), "objects": self.objects}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def add_prefix(self, prefix):
+        versions = {}
+        for path in self.storage.list(prefix):
+            m = PDF_NAME_PATTERN.match(os.path.basename(path))
+            if m is None:
+                continue
+            stem, version = m.group(1), int(m.group(2))
+            if version > versions.get(stem, (0, None))[0]:
+                versions[stem] = (version, path)
+        for stem, (_, path) in versions.items():
+            self.objects[get_arxiv_id(prefix, stem)] = path
+        self.prefixes.add(prefix)
+
+    def update(self, id_list):
+        """ List the prefixes needed to resolve the IDs in id_list that have not been listed yet.
+            Prefixes that could not be listed are not recorded, so they are listed again next time.
+
+        Returns:
+            list: Prefixes that have been listed
+        """
+        prefixes = set()
+        for arxiv_id in id_list:
+            prefix_and_stem = get_pdf_prefix(arxiv_id)
+            if prefix_and_stem is not None:
+                prefixes.add(prefix_and_stem[0])
+        new_prefixes = []
+        for prefix in sorted(prefixes - self.prefixes):
+            try:
+                self.add_prefix(prefix)
+            except StorageError as e:
+                print(e)
+                continue
+            new_prefixes.append(prefix)
+        if new_prefixes:
+            self.save()
+        return new_prefixes
+
+    def resolve(self, arxiv_id):
+        """ Get the path of the latest version of an article's PDF, or None if it does not exist """
+        return self.objects.get(arxiv_id)
@@ -0,0 +1,123 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from tqdm import tqdm
+from src.utils import (
+    ARCHIVE_EXTENSIONS,
+    compress_dir,
+    extract_archive,
+    get_archive_path,
+    list_archive_members,
+    read_archive_member,
+)
+
+
+def get_dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, fname))
+        for root, _, fnames in os.walk(path) for fname in fnames
+    )
+
+
+def benchmark_format(archive_format, page_folders, output_dir, n_reads, seed=0):
+    """ Measure write and random page read throughput of an archive format
+
+    Args:
+        archive_format (string): Archive format
+        page_folders (list): Folders containing the pages of a document
+        output_dir (string): Folder in which archives are written
+        n_reads (int): Number of pages read at random
+
+    Returns:
+        dict: Benchmark results
+    """
+    os.makedirs(output_dir)
+    input_size = sum(get_dir_size(folder) for folder in page_folders)
+
+    start = time.perf_counter()
+    archive_paths = []
+    for folder in page_folders:
+        doc_id = os.path.basename(folder)
+        archive_path = get_archive_path(output_dir, doc_id, archive_format)
+        compress_dir(archive_path, folder, archive_format=archive_format)
+        archive_paths.append(archive_path)
+    write_time = time.perf_counter() - start
+
+    pages = [(path, member) for path in archive_paths for member in list_archive_members(path)]
+    rng = random.Random(seed)
+    to_read = [rng.choice(pages) for _ in range(n_reads)]
+
+    start = time.perf_counter()
+    read_size = sum(len(read_archive_member(path, member)) for path, member in to_read)
+    read_time = time.perf_counter() - start
+
+    return {
+        "format": archive_format,
+        "size_mb": sum(get_dir_size(path) for path in archive_paths) / 1e6,
+        "write_mb_s": input_size / 1e6 / write_time,
+        "read_pages_s": n_reads / read_time,
+        "read_mb_s": read_size / 1e6 / read_time,
+    }
+
+
+def benchmark(args):
+    archives = sorted(os.listdir(args.img_dir))
+    archives = archives[:args.n_docs] if args.n_docs > 0 else archives
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pages_dir = os.path.join(tmp_dir, "pages")
+        os.makedirs(pages_dir)
+        for fname in tqdm(archives, desc=f"Extracting pages from {args.img_dir}"):
+            extract_archive(os.path.join(args.img_dir, fname), pages_dir)
+        page_folders = [os.path.join(pages_dir, doc_id) for doc_id in sorted(os.listdir(pages_dir))]
+
+        print(f"{'format':<8}{'size (MB)':>12}{'write (MB/s)':>15}{'read (pages/s)':>17}{'read (MB/s)':>14}")
+        for archive_format in args.formats:
+            results = benchmark_format(
+                archive_format,
+                page_folders,
+                os.path.join(tmp_dir, archive_format),
+                args.n_reads
+            )
+            print(
+                f"{results['format']:<8}{results['size_mb']:>12.1f}{results['write_mb_s']:>15.1f}"
+                f"{results['read_pages_s']:>17.1f}{results['read_mb_s']:>14.1f}"
+            )
+            shutil.rmtree(os.path.join(tmp_dir, archive_format))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--img_dir",
+        type=str,
+        required=True,
+        help="Output directory of convert_pdf_to_image, in any archive format."
+    )
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        choices=list(ARCHIVE_EXTENSIONS),
+        default=list(ARCHIVE_EXTENSIONS),
+    )
+    parser.add_argument(
+        "--n_docs",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--n_reads",
+        type=int,
+        default=1000,
+        help="Number of pages read at random from the archives."
+    )
+
+    args = parser.parse_args()
+
+    benchmark(args)
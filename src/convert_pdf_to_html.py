@@ -6,22 +6,43 @@ import os
 import shutil
 import argparse
 from tqdm import tqdm
-from src.utils import remove_processed_from_id_list
-from multiprocessing import Process
-import PyPDF2
-from PyPDF2 import PdfFileReader
+import signal
+import resource
+import copy
+import shlex
+import queue
+import json
+import tempfile
+import threading
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from src.utils import remove_processed_from_id_list, open_file, add_compression_ext
+from multiprocessing import Pool
+from src.pdf_probe import probe_pdf_cached
+from src.parse_html import extract_page_texts
+from src.scheduling import SCHEDULES, sort_largest_first, run_timed, UtilizationTracker
 
-def _is_valid_pdf(filepath, max_pages):
-    try:
-        with open(filepath, "rb") as pdf_file:
-            pdf_reader = PdfFileReader(pdf_file, strict=False)
-            num_pages = pdf_reader.numPages
-        if max_pages > 0 and num_pages > max_pages: 
-            return False 
-        else:
-            return True 
-    except (PyPDF2.utils.PdfReadError, OSError, ValueError, AssertionError):
+# Conversion statuses
+CONVERTED = "ok"
+TIMEOUT = "timeout"
+OUT_OF_MEMORY = "oom"
+CRASHED = "crash"
+INVALID = "invalid"
+FAILED = "failed"
+
+RETRYABLE_FAILURES = (TIMEOUT, OUT_OF_MEMORY, CRASHED)
+TIMEOUT_EXIT_STATUS = 124 # exit status of coreutils timeout, used in containers
+# grace period before timeout sends SIGKILL, and before the docker client itself is killed
+DOCKER_KILL_DELAY = 5
+OOM_MARKERS = (b"out of memory", b"bad_alloc", b"cannot allocate memory")
+
+def _is_valid_pdf(filepath, max_pages, probe_cache=None, probe_timeout=10):
+    probe = probe_pdf_cached(filepath, db_path=probe_cache, timeout=probe_timeout)
+    if not probe["valid"]:
+        return False
+    if max_pages > 0 and probe["num_pages"] > max_pages: 
         return False 
+    return True 
 
 def pdf2flowhtml(
     input_dir: Union[Path, str],
@@ -32,6 +53,13 @@ def pdf2flowhtml(
     use_docker: bool,
     first_page: int,
     max_pages: int,
+    timeout: Optional[float] = None,
+    probe_cache: Optional[str] = None,
+    memory_limit: Optional[int] = None,
+    cpu_limit: Optional[int] = None,
+    compression: Optional[str] = None,
+    docker_cmd: str = "sudo docker",
+    docker_image: str = "poppler",
 ) -> str:
 
     if use_docker:
@@ -40,28 +68,499 @@ def pdf2flowhtml(
         )
     else:
         filepath = os.path.join(pdf_folder, filename)
-    if not _is_valid_pdf(filepath, max_pages=max_pages):
-        return False
+    if not _is_valid_pdf(filepath, max_pages=max_pages, probe_cache=probe_cache):
+        return INVALID
+
+    if use_docker:
+        output_path = os.path.join(input_dir, output_folder, outputfile)
+    else:
+        output_path = os.path.join(output_folder, outputfile)
+
+    # compressed outputs are streamed from the standard output of pdftotext
+    stream_path = output_path if compression else None
+    output_arg = "-" if compression else os.path.join(output_folder, outputfile)
 
     if use_docker:
-        command = "sudo docker run --rm -v {}:/pdf -v /tmp:/tmp poppler pdftotext -f {} -bbox-layout '{}' '{}'".format(
+        # the timeout is enforced in the container, killing the docker client would 
+        # leave pdftotext running. The client is only killed if the container hangs.
+        timeout_cmd = f"timeout -k {DOCKER_KILL_DELAY} {timeout} " if timeout is not None else ""
+        command = "{} run --rm -v {}:/pdf -v /tmp:/tmp {} {}pdftotext -f {} -bbox-layout '{}' '{}'".format(
+            docker_cmd,
             os.path.abspath(input_dir),
+            docker_image,
+            timeout_cmd,
             first_page,
             os.path.join(pdf_folder, filename),
-            os.path.join(output_folder, outputfile)
+            output_arg
         )
+        client_timeout = timeout + 2 * DOCKER_KILL_DELAY if timeout is not None else None
+        # resource limits would only apply to the docker client
+        status = run_command(command, timeout=client_timeout, output_path=stream_path, compression=compression)
     else:
         command = "pdftotext -f {} -bbox-layout '{}' '{}'".format(
             first_page,
             os.path.join(pdf_folder, filename),
-            os.path.join(output_folder, outputfile)
+            output_arg
+        )
+        status = run_command(
+            command, 
+            timeout=timeout, 
+            memory_limit=memory_limit, 
+            cpu_limit=cpu_limit, 
+            output_path=stream_path, 
+            compression=compression,
+        )
+
+    if status != CONVERTED and os.path.isfile(output_path): # remove partial output
+        os.remove(output_path)
+    return status
+
+
+def _limit_resources(memory_limit, cpu_limit):
+    """ Get a function setting address space (in MB) and CPU time (in seconds) limits of a child process """
+    def set_limits():
+        if memory_limit is not None:
+            memory_limit_bytes = memory_limit * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+        if cpu_limit is not None:
+            # SIGXCPU is sent at the soft limit, SIGKILL at the hard limit
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+    return set_limits
+
+
+def classify_exit(returncode, stderr=b""):
+    """ Classify the exit of pdftotext 
+
+    Args:
+        returncode (int): Exit status, negative if the process was killed by a signal
+        stderr (bytes): Error output
+
+    Returns:
+        string: Conversion status
+    """
+    if returncode == 0:
+        return CONVERTED
+    if returncode == TIMEOUT_EXIT_STATUS:
+        return TIMEOUT
+    if any(marker in stderr.lower() for marker in OOM_MARKERS):
+        return OUT_OF_MEMORY
+    if returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+        return TIMEOUT
+    if returncode < 0 or returncode > 128: # killed by a signal
+        return CRASHED
+    if returncode == 1: # pdftotext could not open the PDF
+        return INVALID
+    return FAILED
+
+
+def run_command(command, timeout=None, memory_limit=None, cpu_limit=None, output_path=None, compression=None):
+    """ Run a shell command under resource limits, killing it and its children if it 
+        exceeds the timeout
+
+    Args:
+        command (string): Shell command
+        timeout (float): Timeout in seconds, None for no timeout
+        memory_limit (int): Address space limit in MB, None for no limit
+        cpu_limit (int): CPU time limit in seconds, None for no limit
+        output_path (string): If given, the standard output of the command is streamed to this file
+        compression (string): Compression of the output file ("gzip", "zstd" or None)
+
+    Returns:
+        string: Conversion status
+    """
+    preexec_fn = None
+    if memory_limit is not None or cpu_limit is not None:
+        preexec_fn = _limit_resources(memory_limit, cpu_limit)
+
+    with tempfile.TemporaryFile() as stderr_file:
+        # exec so that signals killing the command are reported in its exit status
+        process = subprocess.Popen(
+            "exec " + command, 
+            shell=True, 
+            stdout=subprocess.PIPE if output_path is not None else subprocess.DEVNULL, 
+            stderr=stderr_file, 
+            start_new_session=True,
+            preexec_fn=preexec_fn,
+        )
+
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            os.killpg(process.pid, signal.SIGKILL)
+
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer is not None:
+            timer.start()
+        try:
+            if output_path is not None:
+                with open_file(output_path, "wb", compression=compression) as fw:
+                    shutil.copyfileobj(process.stdout, fw, 1 << 20)
+                process.stdout.close()
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out.is_set():
+            return TIMEOUT
+        stderr_file.seek(0)
+        return classify_exit(process.returncode, stderr_file.read())
+
+
+# Converts (input, output) pairs given as arguments, after the first page, and prints 
+# the exit status of pdftotext for each of them. Each conversion is killed after the 
+# timeout (0 for no timeout), its partial output removed and TIMEOUT_EXIT_STATUS printed.
+DOCKER_DRIVER_SCRIPT = (
+    'first_page=$1; timeout=$2; shift 2; '
+    'while [ $# -gt 1 ]; do '
+    'if [ "$timeout" = 0 ]; then '
+    'pdftotext -f "$first_page" -bbox-layout "$1" "$2" > /dev/null 2>&1; '
+    'else '
+    f'timeout -k {DOCKER_KILL_DELAY} "$timeout" pdftotext -f "$first_page" -bbox-layout "$1" "$2" > /dev/null 2>&1; '
+    'fi; '
+    'status=$?; '
+    f'if [ "$timeout" != 0 ] && [ $status -eq {TIMEOUT_EXIT_STATUS} -o $status -eq 137 ]; then rm -f "$2"; status={TIMEOUT_EXIT_STATUS}; fi; '
+    'echo $status; shift 2; '
+    'done'
+)
+
+
+# Failures of a driver run
+DRIVER_HUNG = "hung"
+CONTAINER_FAILED = "container_failed"
+MAX_CONTAINER_FAILURES = 3
+
+
+class DockerWorkers:
+    """ Long-lived poppler containers converting batches of PDFs with a single exec per batch
+
+    Args:
+        input_dir (string): Directory mounted as /pdf in the containers
+        num_workers (int): Number of containers
+        docker_cmd (string): Command used to call docker (e.g. "sudo docker"). Any 
+                             executable implementing `run -d`, `exec` and `rm -f` can be used.
+        image (string): Docker image providing pdftotext
+    """
+
+    def __init__(self, input_dir, num_workers, docker_cmd="sudo docker", image="poppler"):
+        self.input_dir = os.path.abspath(input_dir)
+        self.num_workers = num_workers
+        self.docker_cmd = shlex.split(docker_cmd)
+        self.image = image
+        self.containers = queue.Queue()
+
+    def __enter__(self):
+        for _ in range(self.num_workers):
+            self.containers.put(self._start_container())
+        return self
+
+    def __exit__(self, *exc):
+        container_ids = []
+        while not self.containers.empty():
+            container_ids.append(self.containers.get())
+        if container_ids:
+            subprocess.run(
+                self.docker_cmd + ["rm", "-f"] + container_ids, 
+                stdout=subprocess.DEVNULL, 
+                stderr=subprocess.DEVNULL,
+            )
+
+    def _start_container(self):
+        output = subprocess.check_output(
+            self.docker_cmd + [
+                "run", "-d", "--rm", 
+                "-v", f"{self.input_dir}:/pdf", 
+                "-v", "/tmp:/tmp", 
+                self.image, 
+                "sleep", "infinity",
+            ]
         )
+        return output.decode("utf-8").strip()
+
+    def _replace_container(self, container_id):
+        subprocess.run(
+            self.docker_cmd + ["rm", "-f", container_id], 
+            stdout=subprocess.DEVNULL, 
+            stderr=subprocess.DEVNULL,
+        )
+        return self._start_container()
+
+    def _run_driver(self, pairs, first_page, timeout=None, batch_timeout=None):
+        """ Run the driver script on pairs in one of the containers. If the exec fails 
+            (e.g. the container died) or the driver hangs, the container is replaced.
+
+        Returns:
+            list: Conversion status of the PDFs reported by the driver, in order
+            string: None if the driver completed, DRIVER_HUNG or CONTAINER_FAILED otherwise
+        """
+        container_id = self.containers.get()
+        command = self.docker_cmd + [
+            "exec", container_id, "sh", "-c", DOCKER_DRIVER_SCRIPT, "sh", str(first_page), 
+            str(timeout) if timeout is not None else "0"
+        ] + [path for pair in pairs for path in pair]
+
+        failure = None
+        try:
+            completed = subprocess.run(
+                command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=batch_timeout
+            )
+            output = completed.stdout
+            if completed.returncode != 0:
+                failure = CONTAINER_FAILED
+        except subprocess.TimeoutExpired as e:
+            output = e.stdout or b""
+            failure = DRIVER_HUNG
+        try:
+            if failure is not None:
+                # the batch may still be running in the container, or the container is dead
+                container_id = self._replace_container(container_id)
+        finally:
+            self.containers.put(container_id)
+        return [classify_exit(int(code)) for code in output.decode("utf-8").split()], failure
+
+    def convert_batch(self, pairs, first_page, timeout=None):
+        """ Convert a batch of PDFs in one of the containers. Each conversion is limited 
+            by timeout in the container. PDFs the driver did not report on are sent again, 
+            in a new container if the previous one failed. A PDF is considered as timed out 
+            if the driver hung on it, and as crashed if it brought down MAX_CONTAINER_FAILURES 
+            containers in a row, so that rounds keep making progress.
+
+        Args:
+            pairs (list): (input_path, output_path) tuples, relative to input_dir
+            first_page (int): First page to convert
+            timeout (float): Timeout in seconds for a single PDF, None for no timeout
+
+        Returns:
+            list: Conversion status of each PDF
+        """
+        statuses = []
+        num_failures = 0
+        while len(statuses) < len(pairs):
+            remaining = pairs[len(statuses):]
+            # safety net in case the driver itself hangs
+            batch_timeout = (timeout + 10) * len(remaining) if timeout is not None else None
+            reported, failure = self._run_driver(
+                remaining, first_page, timeout=timeout, batch_timeout=batch_timeout
+            )
+            statuses.extend(reported[:len(remaining)])
+            if failure is None or reported:
+                num_failures = 0
+                continue
+
+            num_failures += 1
+            if failure == DRIVER_HUNG or num_failures >= MAX_CONTAINER_FAILURES:
+                output_path = os.path.join(self.input_dir, remaining[0][1])
+                if os.path.isfile(output_path): # remove partial output
+                    os.remove(output_path)
+                statuses.append(TIMEOUT if failure == DRIVER_HUNG else CRASHED)
+                num_failures = 0
+        return statuses
+
+
+def convert_with_docker_workers(args, fnames, tracker=None):
+    """ Convert PDFs in batches using long-lived containers. Yields (filename, status) """
+    def _convert_batch(batch):
+        results = {}
+        pairs = []
+        for filename in batch:
+            filepath = os.path.join(args.input_dir, args.pdf_folder, filename)
+            if _is_valid_pdf(filepath, max_pages=args.max_pages, probe_cache=args.probe_cache):
+                pairs.append((
+                    os.path.join(args.pdf_folder, filename), 
+                    os.path.join(args.output_folder, filename[:-4] + ".html")
+                ))
+            else:
+                results[filename] = INVALID
+
+        if pairs:
+            timeout = args.timeout if args.timeout > 0 else None
+            statuses = workers.convert_batch(pairs, args.first_page, timeout=timeout)
+            for (pdf_path, _), status in zip(pairs, statuses):
+                results[os.path.basename(pdf_path)] = status
+        return [(filename, results[filename]) for filename in batch]
+
+    batches = [fnames[i: i+args.docker_batch_size] for i in range(0, len(fnames), args.docker_batch_size)]
+    with DockerWorkers(
+        args.input_dir, args.docker_workers, docker_cmd=args.docker_cmd, image=args.docker_image
+    ) as workers:
+        with ThreadPool(args.docker_workers) as pool:
+            for worker_id, duration, batch_results in pool.imap_unordered(
+                partial(run_timed, _convert_batch), batches
+            ):
+                if tracker is not None:
+                    tracker.record(worker_id, duration, num_docs=len(batch_results))
+                yield from batch_results
+
+
+def get_page_windows(num_pages, first_page, head_pages, tail_pages):
+    """ Get the page ranges covering the first head_pages and last tail_pages pages
+
+    Returns:
+        list: Non-overlapping (start, end) page ranges, with 1-indexed and inclusive bounds
+    """
+    windows = []
+    if head_pages > 0:
+        windows.append((first_page, min(num_pages, first_page + head_pages - 1)))
+    if tail_pages > 0:
+        start = max(first_page, num_pages - tail_pages + 1)
+        if windows and start <= windows[-1][1] + 1: # merge overlapping windows
+            windows[-1] = (windows[-1][0], num_pages)
+        else:
+            windows.append((start, num_pages))
+    return [(start, end) for start, end in windows if start <= end]
+
+
+def pdf2abstract_search(
+    pdf_folder: Union[Path, str],
+    filename: Union[Path, str],
+    output_folder: Union[Path, str],
+    first_page: int,
+    head_pages: int,
+    tail_pages: int,
+    max_pages: int,
+    timeout: Optional[float] = None,
+    probe_cache: Optional[str] = None,
+    memory_limit: Optional[int] = None,
+    cpu_limit: Optional[int] = None,
+) -> str:
+    """ Convert only the first and last pages of a PDF, to search its abstract
+
+    The output is a JSON file containing the number of pages of the PDF and the 
+    text of each converted page, indexed by its page number in the PDF.
+    """
+    filepath = os.path.join(pdf_folder, filename)
+    probe = probe_pdf_cached(filepath, db_path=probe_cache)
+    if not probe["valid"] or (max_pages > 0 and probe["num_pages"] > max_pages):
+        return INVALID
+
+    num_pages = probe["num_pages"]
+    pages = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for start, end in get_page_windows(num_pages, first_page, head_pages, tail_pages):
+            html_path = os.path.join(tmp_dir, f"{start}-{end}.html")
+            command = "pdftotext -f {} -l {} -bbox-layout '{}' '{}'".format(
+                start, end, filepath, html_path
+            )
+            status = run_command(command, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit)
+            if status != CONVERTED:
+                return status
+            for page_idx, text in enumerate(extract_page_texts(html_path)):
+                pages[str(start + page_idx)] = text
+
+    doc_id = filename[:-4]
+    with open(os.path.join(output_folder, doc_id + ".json"), "w", encoding="utf-8") as fw:
+        json.dump({"id": doc_id, "num_pages": num_pages, "pages": pages}, fw, ensure_ascii=False)
+    return CONVERTED
+
+
+def _get_limit(value):
+    return value if value > 0 else None
+
+
+def convert_file(filename, args):
+    if args.abstract_search:
+        status = pdf2abstract_search(
+            args.pdf_folder,
+            filename,
+            args.output_folder,
+            args.first_page,
+            args.head_pages,
+            args.tail_pages,
+            args.max_pages,
+            timeout=_get_limit(args.timeout),
+            probe_cache=args.probe_cache,
+            memory_limit=_get_limit(args.memory_limit),
+            cpu_limit=_get_limit(args.cpu_limit),
+        )
+        return filename, status
+
+    output_fname = add_compression_ext(filename[:-4] + ".html", args.compression)
+    status = pdf2flowhtml(
+        args.input_dir, 
+        args.pdf_folder, 
+        filename, 
+        args.output_folder, 
+        output_fname, 
+        args.use_docker,
+        args.first_page,
+        args.max_pages,
+        timeout=_get_limit(args.timeout),
+        probe_cache=args.probe_cache,
+        memory_limit=_get_limit(args.memory_limit),
+        cpu_limit=_get_limit(args.cpu_limit),
+        compression=args.compression,
+        docker_cmd=args.docker_cmd,
+        docker_image=args.docker_image,
+    )
+    return filename, status
+
+
+def quarantine(args, filename, status, attempt):
+    """ Record a failed conversion in the quarantine ledger """
+    with open(args.quarantine_log, "a") as f:
+        f.write(json.dumps({
+            "id": filename[:-4], 
+            "status": status, 
+            "attempt": attempt,
+            "timeout": args.timeout,
+            "memory_limit": args.memory_limit,
+            "cpu_limit": args.cpu_limit,
+        }) + "\n")
+
+
+def log_conversion(args, filename, status, attempt=1):
+    if status != CONVERTED:
+        quarantine(args, filename, status, attempt)
+    log_path = args.converted_output_log if status == CONVERTED else args.failed_output_log
+    with open(log_path, "a") as f:
+        f.write(filename[:-4] + "\n")
+
+
+def get_retry_args(args):
+    """ Relax limits to retry conversions that timed out, ran out of memory or crashed """
+    retry_args = copy.copy(args)
+    for limit in ("timeout", "memory_limit", "cpu_limit"):
+        if getattr(args, limit) > 0:
+            setattr(retry_args, limit, getattr(args, limit) * 2)
+    return retry_args
+
+
+def retry_conversions(args, fnames):
+    retry_args = get_retry_args(args)
+    if retry_args.use_docker and retry_args.docker_workers > 0:
+        results = convert_with_docker_workers(retry_args, fnames)
+    else:
+        results = (convert_file(filename, retry_args) for filename in fnames)
+    for filename, status in tqdm(results, total=len(fnames), desc="Retrying failed conversions"):
+        log_conversion(retry_args, filename, status, attempt=2)
+
+
+def iter_conversions(args, fnames, tracker=None):
+    """ Convert PDFs, yielding (filename, status) as conversions complete. Results are 
+        logged from the main process only. PDFs are handed out one at a time, in the 
+        order of fnames.
+    """
+    if args.use_docker and args.docker_workers > 0:
+        yield from convert_with_docker_workers(args, fnames, tracker=tracker)
+        return
     
-    try: 
-        subprocess.check_output(command, shell=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        return False
+    if args.num_processors > 0:
+        pool = Pool(args.num_processors)
+        timed_results = pool.imap_unordered(
+            partial(run_timed, partial(convert_file, args=args)), fnames, chunksize=1
+        )
+    else:
+        pool = None
+        timed_results = (run_timed(convert_file, filename, args) for filename in fnames)
+
+    try:
+        for worker_id, duration, result in timed_results:
+            if tracker is not None:
+                tracker.record(worker_id, duration)
+            yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
 
 
 def convert(args):
@@ -70,6 +569,10 @@ def convert(args):
     else:
         pdf_path = args.pdf_folder
     fnames = sorted(os.listdir(pdf_path))
+    if args.id_list is not None:
+        with open(args.id_list, "r") as f:
+            ids_to_convert = set(f.read().splitlines())
+        fnames = [fname for fname in fnames if fname[:-4] in ids_to_convert]
     fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
 
     if args.resume:
@@ -79,47 +582,26 @@ def convert(args):
         fnames = remove_processed_from_id_list(
             fnames, args.converted_output_log
         )
-        fnames = fnames[1:]
         if not fnames:
             print(f"All documents in {pdf_path} have already been converted to HTML")
             return
         fnames = [fname + ext for fname in fnames]
         
+    fnames = sort_largest_first(pdf_path, fnames, schedule=args.schedule, probe_cache=args.probe_cache)
 
-    if args.num_processors > 0:
-        processes = []
-        partitions = [fnames[i: i+args.num_processors] for i in range(0, len(fnames), args.num_processors)]
-
-        for part in partitions:
-            for filename in tqdm(part):
-                output_fname = filename[:-4] + ".html"
-                p = Process(
-                    target=pdf2flowhtml, 
-                    args=(args.input_dir, args.pdf_folder, filename, args.output_folder, output_fname, args.use_docker, args.first_page, args.max_pages)
-                )
-                p.start()
-                processes.append(p)
-            for p in processes:
-                p.join()
-                
-    else:
-        for filename in tqdm(fnames, desc=f"Processing PDFs in {pdf_path}"):
-            output_fname = filename[:-4] + ".html"
-            if pdf2flowhtml(
-                args.input_dir, 
-                args.pdf_folder, 
-                filename, 
-                args.output_folder, 
-                output_fname, 
-                args.use_docker,
-                args.first_page,
-                args.max_pages
-            ):
-                with open(args.converted_output_log, "a") as f:
-                    f.write(filename[:-4] + "\n")
-            else:
-                with open(args.failed_output_log, "a") as f:
-                    f.write(filename[:-4] + "\n")
+    to_retry = []
+    tracker = UtilizationTracker()
+    results = iter_conversions(args, fnames, tracker=tracker)
+    for filename, status in tqdm(results, total=len(fnames), desc=f"Processing PDFs in {pdf_path}"):
+        if args.retry_failed and status in RETRYABLE_FAILURES:
+            quarantine(args, filename, status, attempt=1)
+            to_retry.append(filename)
+        else:
+            log_conversion(args, filename, status)
+    tracker.report()
+
+    if to_retry:
+        retry_conversions(args, to_retry)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -143,6 +625,30 @@ if __name__ == "__main__":
         "--use_docker", 
         action="store_true", 
     )
+    parser.add_argument(
+        "--docker_workers", 
+        type=int,
+        default=-1,
+        help="Number of long-lived containers to convert PDFs with. If -1, one container "\
+            "is started per PDF."
+    )
+    parser.add_argument(
+        "--docker_batch_size", 
+        type=int,
+        default=32,
+        help="Number of PDFs converted by a single exec in a long-lived container."
+    )
+    parser.add_argument(
+        "--docker_cmd", 
+        type=str,
+        default="sudo docker",
+    )
+    parser.add_argument(
+        "--docker_image", 
+        type=str,
+        default="poppler",
+        help="Docker image providing pdftotext."
+    )
     parser.add_argument(
         "--first_page", 
         type=int,
@@ -153,16 +659,90 @@ if __name__ == "__main__":
         type=int,
         default=-1,
     )
+    parser.add_argument(
+        "--compression", 
+        type=str,
+        choices=["gzip", "zstd"],
+        default=None,
+        help="Compress HTML outputs."
+    )
+    parser.add_argument(
+        "--abstract_search", 
+        action="store_true", 
+        help="Only convert the first --head_pages and last --tail_pages pages of each PDF, "\
+            "and save their text to search abstracts."
+    )
+    parser.add_argument(
+        "--head_pages", 
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--tail_pages", 
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--id_list", 
+        type=str,
+        default=None,
+        help="File containing the IDs of the documents to convert (e.g. the log of documents whose "\
+            "abstract was found)."
+    )
+    parser.add_argument(
+        "--timeout", 
+        type=float,
+        default=-1,
+        help="Maximum time (in seconds) allowed to convert a single PDF. -1 for no limit."
+    )
+    parser.add_argument(
+        "--memory_limit", 
+        type=int,
+        default=-1,
+        help="Maximum address space (in MB) of pdftotext. -1 for no limit."
+    )
+    parser.add_argument(
+        "--cpu_limit", 
+        type=int,
+        default=-1,
+        help="Maximum CPU time (in seconds) of pdftotext. -1 for no limit."
+    )
+    parser.add_argument(
+        "--retry_failed", 
+        action="store_true", 
+        help="After the main run, retry once conversions that timed out, ran out of memory or "\
+            "crashed, with doubled limits."
+    )
+    parser.add_argument(
+        "--quarantine_log",
+        type=str,
+        default="./quarantine.jsonl",
+        help="Ledger of failed conversions, with their failure type (timeout, oom, crash, invalid, failed)."
+    )
     parser.add_argument(
         "--n_docs", 
         type=int,
         default=5,
     )
+    parser.add_argument(
+        "--schedule", 
+        type=str,
+        choices=SCHEDULES,
+        default="size",
+        help="Order in which PDFs are handed out to workers: by name, or largest first by "\
+            "file size or page count."
+    )
     parser.add_argument(
         "--max_pages", 
         type=int,
         default=-1,
     )
+    parser.add_argument(
+        "--probe_cache",
+        type=str,
+        default="./pdf_probe.db",
+        help="Database caching page counts and validity of PDFs, so that each PDF is only probed once."
+    )
     parser.add_argument(
         "--converted_output_log",
         type=str,
@@ -186,6 +766,16 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.compression and args.use_docker and args.docker_workers > 0:
+        raise ValueError(
+            "Cannot use --compression and --docker_workers at the same time."
+        )
+
+    if args.abstract_search and args.use_docker:
+        raise ValueError(
+            "Cannot use --abstract_search and --use_docker at the same time."
+        )
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
             f"Cannot use --resume and --overwrite_output_dir at the same time."
@@ -1,17 +1,176 @@
 import argparse 
 import os
 import shutil
+import re
+from functools import partial
+from multiprocessing import Pool
 from tqdm import tqdm 
-from pdf2image import convert_from_path
-from src.utils import remove_processed_from_id_list, compress_dir
+from pdf2image import convert_from_path, pdfinfo_from_path
+from src.utils import (
+    remove_processed_from_id_list, 
+    compress_dir, 
+    find_archive,
+    get_archive_path, 
+    get_page_image_name,
+    ARCHIVE_EXTENSIONS,
+    IMAGE_EXTENSIONS,
+)
+from src.scheduling import SCHEDULES, sort_largest_first, run_timed, UtilizationTracker
+from src.pdf_probe import probe_pdf_cached
+from src.page_store import PageStoreWriter
+from src.parse_html import load_page_index
+
+input_ext = ".pdf"
+
+
+def parse_size(size):
+    """ Parse a target image size, either "N" (longest side) or "WxH"
+
+    Returns:
+        int or tuple: Size as expected by pdf2image, or None
+    """
+    if size is None:
+        return None
+    if "x" in size:
+        width, height = size.split("x")
+        return (int(width), int(height))
+    return int(size)
+
+
+def get_page_chunks(page_numbers, chunk_size):
+    """ Split page numbers into ranges of consecutive pages of at most chunk_size pages
+
+    Returns:
+        list: (first page, last page) tuples
+    """
+    chunks = []
+    for page_num in sorted(set(page_numbers)):
+        if chunks and page_num == chunks[-1][1] + 1 and page_num - chunks[-1][0] < chunk_size:
+            chunks[-1] = (chunks[-1][0], page_num)
+        else:
+            chunks.append((page_num, page_num))
+    return chunks
+
+
+def iter_rendered_pages(pdf_path, dpi, page_numbers, chunk_size, thread_count=1, size=None, grayscale=False):
+    """ Render the given pages by chunks of at most chunk_size consecutive pages, so 
+        that at most one chunk of pages is held in memory. Pages of a chunk are split 
+        between thread_count pdftoppm processes.
+
+    Args:
+        page_numbers (list): PDF page numbers of the pages to render
+        size (int or tuple): If given, pages are rendered to this size instead of dpi, 
+                             see parse_size
+        grayscale (bool): Render pages in greyscale
+
+    Yields:
+        tuple: Page number and rendered page
+    """
+    for chunk_start, chunk_end in get_page_chunks(page_numbers, chunk_size):
+        pages = convert_from_path(
+            pdf_path, 
+            dpi=dpi, 
+            first_page=chunk_start, 
+            last_page=chunk_end, 
+            thread_count=min(thread_count, chunk_end - chunk_start + 1),
+            size=size,
+            grayscale=grayscale,
+        )
+        for page_num, page in enumerate(pages, start=chunk_start):
+            yield page_num, page
+        del pages
+
+
+def convert_file(fname, args, pdf_pages=None):
+    """ Render the pages of a PDF and archive them
+
+    Args:
+        fname (string): PDF file name
+        pdf_pages (list): If given, the pages to render, page i being saved as page 
+                          pdf_pages[i-1] of the PDF (see the page index of parse_html). 
+                          Otherwise, pages from --first_page are rendered.
+
+    Returns:
+        string: Document ID
+    """
+    doc_id = fname[:-len(input_ext)]
+    pdf_path = os.path.join(args.input_dir, fname)
+    output_folder = os.path.join(args.output_dir, doc_id)
+
+    # convert
+    if os.path.isdir(output_folder):
+        # left over by an interrupted conversion
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+    if pdf_pages is None:
+        num_pages = probe_pdf_cached(pdf_path, db_path=args.probe_cache)["num_pages"]
+        if num_pages is None:
+            num_pages = pdfinfo_from_path(pdf_path)["Pages"]
+        pdf_pages = list(range(args.first_page, num_pages + 1))
+    # pages are numbered as in the token file, or from first_page
+    output_page_nums = {pdf_page: i+1 for i, pdf_page in enumerate(pdf_pages)}
+
+    pages = iter_rendered_pages(
+        pdf_path, 
+        args.dpi, 
+        pdf_pages, 
+        args.chunk_size, 
+        thread_count=args.thread_count,
+        size=parse_size(args.size),
+        grayscale=args.grayscale,
+    )
+    for page_num, p in pages:
+        p.save(
+            os.path.join(output_folder, get_page_image_name(doc_id, output_page_nums[page_num], args.image_format)), 
+            format=args.image_format.upper(),
+            quality=args.quality,
+        )
+        p.close()
+
+    # archive output images
+    if args.archive_format != "dir":
+        archive_path = get_archive_path(args.output_dir, doc_id, args.archive_format)
+        compress_dir(archive_path, output_folder, archive_format=args.archive_format)
+        shutil.rmtree(output_folder)
+    return doc_id
+
+
+def _convert_item(item, args):
+    fname, pdf_pages = item
+    return convert_file(fname, args, pdf_pages=pdf_pages)
+
+
+def iter_conversions(args, fnames, tracker=None, page_index=None):
+    """ Convert PDFs, yielding document IDs as conversions complete. Documents are 
+        handed out one at a time, in the order of fnames.
+    """
+    items = [
+        (fname, page_index[fname[:-len(input_ext)]] if page_index is not None else None) 
+        for fname in fnames
+    ]
+    if args.num_workers > 0:
+        pool = Pool(args.num_workers)
+        timed_results = pool.imap_unordered(
+            partial(run_timed, partial(_convert_item, args=args)), items, chunksize=1
+        )
+    else:
+        pool = None
+        timed_results = (run_timed(_convert_item, item, args) for item in items)
+
+    try:
+        for worker_id, duration, doc_id in timed_results:
+            if tracker is not None:
+                tracker.record(worker_id, duration)
+            yield doc_id
+    finally:
+        if pool is not None:
+            pool.terminate()
+
 
 def convert(args):
     fnames = sorted(os.listdir(args.input_dir))
     fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
 
-    input_ext = ".pdf"
-    output_ext = ".jpg"
-
     if args.resume:
         fnames = [fname[:-len(input_ext)] for fname in fnames]
         print("Resuming conversion...")
@@ -21,26 +180,28 @@ def convert(args):
             return
         fnames = [fname + input_ext for fname in fnames]
 
-    for fname in tqdm(fnames):
-        doc_id = fname[:-len(input_ext)]
-        pdf_path = os.path.join(args.input_dir, fname)
-        output_folder = os.path.join(args.output_dir, doc_id)
-
-        # convert
-        os.makedirs(output_folder)
-        pages = convert_from_path(pdf_path, dpi=args.dpi)
-        pages = pages[args.first_page-1:]
-        for i, p in enumerate(pages):
-            p.save(os.path.join(output_folder, doc_id + "-" + str(i+1) + output_ext))
-
-        # compress output images
-        tar_path = os.path.join(args.output_dir, doc_id + ".tar.gz")
-        compress_dir(tar_path, output_folder)
-        shutil.rmtree(output_folder)
+    page_index = None
+    if args.page_index is not None:
+        # only render pages that have text
+        page_index = load_page_index(args.page_index)
+        num_docs = len(fnames)
+        fnames = [fname for fname in fnames if fname[:-len(input_ext)] in page_index]
+        print(f"{num_docs - len(fnames)} documents without token file in {args.page_index} are skipped")
 
+    fnames = sort_largest_first(args.input_dir, fnames, schedule=args.schedule, probe_cache=args.probe_cache)
+
+    page_store = PageStoreWriter(args.page_store_dir) if args.page_store_dir is not None else None
+    tracker = UtilizationTracker()
+    results = iter_conversions(args, fnames, tracker=tracker, page_index=page_index)
+    for doc_id in tqdm(results, total=len(fnames)):
+        # only the main process writes to the log and the page store
+        if page_store is not None:
+            page_store.add_document(doc_id, find_archive(args.output_dir, doc_id))
         with open(args.converted_output_log, "a") as f:
             f.write(doc_id + "\n")
-       
+    tracker.report()
+    if page_store is not None:
+        page_store.close()
 
 
 if __name__ == "__main__":
@@ -60,16 +221,95 @@ if __name__ == "__main__":
         type=int,
         default=1,
     )
+    parser.add_argument(
+        "--page_index", 
+        type=str,
+        default=None,
+        help="Page index written by parse_html. If given, exactly the pages of each token file are "\
+            "rendered and numbered as in the token file, and --first_page is ignored."
+    )
     parser.add_argument(
         "--n_docs", 
         type=int,
         default=5,
     )
+    parser.add_argument(
+        "--schedule", 
+        type=str,
+        choices=SCHEDULES,
+        default="size",
+        help="Order in which PDFs are converted: by name, or largest first by file size or page count."
+    )
+    parser.add_argument(
+        "--probe_cache",
+        type=str,
+        default="./pdf_probe.db",
+        help="Database caching page counts of PDFs."
+    )
     parser.add_argument(
         "--dpi", 
         type=int,
         default=100,
     )
+    parser.add_argument(
+        "--size", 
+        type=str,
+        default=None,
+        help="Render pages to a target size instead of --dpi: either \"N\" for a longest side of N "\
+            "pixels, or \"WxH\" for an exact size."
+    )
+    parser.add_argument(
+        "--grayscale", 
+        action="store_true", 
+        help="Render pages in greyscale."
+    )
+    parser.add_argument(
+        "--image_format", 
+        type=str,
+        choices=list(IMAGE_EXTENSIONS),
+        default="jpeg",
+    )
+    parser.add_argument(
+        "--quality", 
+        type=int,
+        default=75,
+        help="JPEG or WebP quality (1-100)."
+    )
+    parser.add_argument(
+        "--chunk_size", 
+        type=int,
+        default=8,
+        help="Number of pages rendered at once. Each page is saved before the next chunk is rendered."
+    )
+    parser.add_argument(
+        "--archive_format", 
+        type=str,
+        choices=list(ARCHIVE_EXTENSIONS),
+        default="tar.gz",
+        help="How the pages of a document are stored. As pages are already JPEG-compressed, \"tar\" "\
+            "and \"zip\" (stored entries) are faster to write and read than \"tar.gz\" for about the "\
+            "same size. \"dir\" keeps one folder per document."
+    )
+    parser.add_argument(
+        "--page_store_dir", 
+        type=str,
+        default=None,
+        help="If given, pages of each converted document are also appended to the sharded page "\
+            "store in this folder (see src/page_store.py)."
+    )
+    parser.add_argument(
+        "--num_workers", 
+        type=int,
+        default=-1,
+        help="Number of processes converting documents in parallel. If -1, documents are converted "\
+            "in the main process."
+    )
+    parser.add_argument(
+        "--thread_count", 
+        type=int,
+        default=1,
+        help="Number of pdftoppm processes rendering the pages of a single document."
+    )
     parser.add_argument(
         "--converted_output_log",
         type=str,
@@ -93,6 +333,11 @@ if __name__ == "__main__":
             f"Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    if args.size is not None and not re.fullmatch(r"[0-9]+(x[0-9]+)?", args.size):
+        raise ValueError(
+            f"Invalid --size ({args.size}), should be \"N\" or \"WxH\"."
+        )
+
     if os.listdir(args.output_dir) and not args.resume:
         if args.overwrite_output_dir:
             print(f"Overwriting {args.output_dir}")
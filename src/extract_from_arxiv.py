@@ -2,12 +2,11 @@
 import argparse
 import os
 from tqdm import tqdm
-import subprocess
-from subprocess import PIPE
-import re
 import json
 import xml.etree.ElementTree as ET
-from pylatexenc.latex2text import LatexNodes2Text 
+from src.latex_to_text import AbstractConverter
+from src.arxiv_storage import ARXIV_BUCKET, ArxivManifest, get_storage
+from src.arxiv_metadata import import_snapshot, lookup_metadata
 from src.utils import (
     del_file_if_exists,
     get_ids_from_arxiv_or_pubmed, 
@@ -16,77 +15,66 @@ from src.utils import (
 )
 
 
-def matches_first_id_scheme(id):
-    """ Checks if id matches identifier scheme used until March 2007 
-            e.g. astro-ph9702020
-
-    Args:
-        id (string): arXiv identifier 
-
-    Returns:
-        bool: True if id matches scheme, False otherwise
-    """
-    
-    p = re.compile("^([a-z\-]*)(\d{7})$")
-    m = p.match(id)
-    return m
-
-def extract_pdf(arxiv_id, pdf_output_path):
-    """ Extract PDF from Google Cloud Storage buckets using gsutil
+def extract_pdf(arxiv_id, pdf_output_path, manifest):
+    """ Extract the latest version of a PDF from the arXiv bucket
 
     Args:
         arxiv_id (string): arXiv identifier
         pdf_output_path (string): Path to output PDF 
+        manifest (ArxivManifest): Index of the PDFs in the bucket
 
     Returns:
         bool: True if PDF has been correctly extracted, False otherwise
     """
-    m = matches_first_id_scheme(arxiv_id)
-    if m:
-        command = [
-            "gsutil",
-            "-q",
-            "ls",
-            f"gs://arxiv-dataset/arxiv/{m.group(1)}/pdf/{m.group(2)[:4]}/{m.group(2)}v*.pdf"
-        ]
-    else:
-        p = re.compile("^(\d{4})\.(\d{4,5})$")
-        m = p.match(arxiv_id)
-        assert m, print(arxiv_id)
-        command = [
-            "gsutil",
-            "-q",
-            "ls",
-            f"gs://arxiv-dataset/arxiv/arxiv/pdf/{m.group(1)}/{arxiv_id}v*.pdf"
-        ]
-
-    p = subprocess.Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    output, err = p.communicate()
-
-    versions = output.decode("utf-8").split("\n")
-    versions = [v for v in versions if v] # remove empty string
-
-    if len(versions) == 0:
+    path = manifest.resolve(arxiv_id)
+    if path is None:
         return False
+    return manifest.storage.copy(path, pdf_output_path)
 
-    if m:
-        sorted_versions = sorted(
-            versions, 
-            key=lambda x: int(re.match(".*" + re.escape(m.group(2)) + "v([0-9]+).pdf", x).group(1))
-        )
-    else:
-        sorted_versions = sorted(
-            versions, 
-            key=lambda x: int(re.match(".*" + re.escape(arxiv_id) + "v([0-9]+).pdf", x).group(1))
-        )
 
-    command = f"gsutil -q cp {sorted_versions[-1]} {pdf_output_path}"
+def log_id(log_path, arxiv_id):
+    with open(log_path, "a") as f:
+        f.write(arxiv_id + "\n")
 
-    subprocess.call(command, shell=True)
 
-    if os.path.exists(pdf_output_path):
-        return True 
-    return False
+def save_abstracts(args, converted):
+    """ Save converted abstracts of articles whose PDF has been extracted, and log the result.
+        Abstracts that could not be converted are logged separately from download failures.
+
+    Returns:
+        int: Number of abstracts that could not be converted
+    """
+    num_fails = 0
+    for arxiv_id, abstract_text in converted:
+        if abstract_text is None:
+            num_fails += 1
+            log_id(args.conversion_failed_output_log, arxiv_id)
+            continue
+        with open(args.abstract_output_path, 'a') as outfile:
+            json.dump(
+                {"id": arxiv_id, "abstract": abstract_text}, 
+                outfile
+            )
+            outfile.write('\n')
+        log_id(args.downloaded_output_log, arxiv_id)
+    return num_fails
+
+
+def iter_metadata(args, id_list):
+    """ Iterate over the metadata of articles, looked up by ID in --metadata_db if given,
+        or streamed from --metadata_file otherwise
+    """
+    if args.metadata_db is not None:
+        if not os.path.isfile(args.metadata_db):
+            print(f"Importing {args.metadata_file} into {args.metadata_db}")
+            import_snapshot(args.metadata_file, args.metadata_db)
+        yield from tqdm(lookup_metadata(args.metadata_db, id_list), total=len(id_list))
+        return
+
+    with open(args.metadata_file, "r") as f:
+        for line in tqdm(f):
+            yield json.loads(line)
+
 
 def extract(args):
     id_list = get_ids_from_arxiv_or_pubmed(args.input_file, args.n_docs)
@@ -96,6 +84,7 @@ def extract(args):
         id_list = remove_processed_from_id_list(
             id_list, args.downloaded_output_log, failed_log=args.failed_output_log
         )
+        id_list = remove_processed_from_id_list(id_list, args.conversion_failed_output_log)
 
         if not id_list:
             print(f"All articles in {args.input_file} have already been extracted")
@@ -103,54 +92,75 @@ def extract(args):
 
     print(f"Extracting {len(id_list)} articles from arXiv, using IDs in {args.input_file}")
 
-    remaining_ids = id_list.copy()
+    manifest = ArxivManifest(args.manifest_file, get_storage(args.bucket))
+    new_prefixes = manifest.update(id_list)
+    print(f"Listed {len(new_prefixes)} new prefixes of {args.bucket}")
+
+    storage = manifest.storage
+    converter = AbstractConverter(
+        cache_path=args.latex_cache, num_workers=args.latex_workers, batch_size=args.latex_batch_size
+    )
+    remaining_ids = set(id_list)
     num_fails = 0
+    num_conversion_fails = 0
+    batch = []
+
+    def _add_article(arxiv_id, metadata, pdf_extracted):
+        """ Queue the abstract of an article for conversion if its PDF has been extracted """
+        if pdf_extracted:
+            converter.submit(arxiv_id, metadata["abstract"].replace("\n", " "))
+            return 0
+        log_id(args.failed_output_log, arxiv_id)
+        return 1
+
+    def _extract_batch(batch):
+        """ Transfer the PDFs of a batch together. Returns the number of failures """
+        pairs = []
+        for arxiv_id, _ in batch:
+            path = manifest.resolve(arxiv_id)
+            pairs.append((path, os.path.join(args.pdf_output_dir, arxiv_id + ".pdf")))
+        to_copy = [pair for pair in pairs if pair[0] is not None]
+        copied = dict(zip(to_copy, storage.copy_many(to_copy, num_workers=args.num_workers)))
+
+        return sum(
+            _add_article(arxiv_id, metadata, copied.get(pair, False))
+            for (arxiv_id, metadata), pair in zip(batch, pairs)
+        )
 
-    with open(args.metadata_file, "r") as f:
-        for line in tqdm(f):
-            metadata = json.loads(line)
-            arxiv_id = metadata["id"].replace("/", "")
-            
-            if arxiv_id in id_list:
+    for metadata in iter_metadata(args, id_list):
+        arxiv_id = metadata["id"].replace("/", "")
+        
+        if arxiv_id in remaining_ids:
+            if args.batch_size > 0:
+                batch.append((arxiv_id, metadata))
+                if len(batch) == args.batch_size:
+                    num_fails += _extract_batch(batch)
+                    batch = []
+            else:
                 pdf_output_path = os.path.join(args.pdf_output_dir, arxiv_id + ".pdf")
-                pdf_extracted = extract_pdf(arxiv_id, pdf_output_path)
-
-                if pdf_extracted: 
-                    abstract_text = metadata["abstract"].replace("\n", " ")
-                    try:
-                        abstract_text = LatexNodes2Text().latex_to_text(abstract_text)
-                        abstract_extracted = True
-                    except IndexError:
-                        abstract_extracted = False
-                        num_fails += 1
-
-                    
-                if pdf_extracted and abstract_extracted:
-                    with open(args.abstract_output_path, 'a') as outfile:
-                        json.dump(
-                            {"id": arxiv_id, "abstract": abstract_text}, 
-                            outfile
-                        )
-                        outfile.write('\n')
-                    with open(args.downloaded_output_log, "a") as f:
-                        f.write(arxiv_id + "\n")
-                else:
-                    num_fails += 1
-                    with open(args.failed_output_log, "a") as f:
-                        f.write(arxiv_id + "\n")
-                
-                remaining_ids.remove(arxiv_id)
-
-                if len(remaining_ids) == 0:
-                    break
-
-    for arxiv_id in remaining_ids: # articles whose abstracts have not been found
+                pdf_extracted = extract_pdf(arxiv_id, pdf_output_path, manifest)
+                num_fails += _add_article(arxiv_id, metadata, pdf_extracted)
+            num_conversion_fails += save_abstracts(args, converter.poll())
+            
+            remaining_ids.remove(arxiv_id)
+
+            if len(remaining_ids) == 0:
+                break
+
+    if batch:
+        num_fails += _extract_batch(batch)
+    num_conversion_fails += save_abstracts(args, converter.poll(wait=True))
+    converter.close()
+
+    for arxiv_id in [arxiv_id for arxiv_id in id_list if arxiv_id in remaining_ids]: # articles whose abstracts have not been found
         num_fails += 1
         with open(args.failed_output_log, "a") as f:
             f.write(arxiv_id + "\n")
 
 
-    print(f"Extracted abstract and PDF for {len(id_list) - num_fails}/{len(id_list)} articles.")
+    print(f"Extracted abstract and PDF for {len(id_list) - num_fails - num_conversion_fails}/{len(id_list)} articles.")
+    if num_conversion_fails:
+        print(f"{num_conversion_fails} abstracts could not be converted to text, see {args.conversion_failed_output_log}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -164,9 +174,16 @@ if __name__ == "__main__":
     parser.add_argument(
         "--metadata_file", 
         type=str,
-        required=True,
+        default=None,
         help="The metadata file containing the abstracts to extract."
     )
+    parser.add_argument(
+        "--metadata_db", 
+        type=str,
+        default=None,
+        help="SQLite store of the metadata file, keyed by ID (see src/arxiv_metadata.py). "\
+            "Imported from --metadata_file if it does not exist."
+    )
     parser.add_argument(
         "--pdf_output_dir", 
         type=str,
@@ -177,6 +194,30 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
+    parser.add_argument(
+        "--bucket", 
+        type=str,
+        default=ARXIV_BUCKET,
+        help="Bucket containing arXiv PDFs, or a local folder with the same layout."
+    )
+    parser.add_argument(
+        "--manifest_file", 
+        type=str,
+        default="./arxiv_manifest.json",
+        help="Index of the latest version of each PDF in --bucket, built by listing each month once."
+    )
+    parser.add_argument(
+        "--batch_size", 
+        type=int,
+        default=-1,
+        help="Number of PDFs transferred together, with up to --num_workers concurrent transfers. "\
+            "If -1, PDFs are transferred one at a time."
+    )
+    parser.add_argument(
+        "--num_workers", 
+        type=int,
+        default=8,
+    )
     parser.add_argument(
         "--downloaded_output_log",
         type=str,
@@ -187,6 +228,30 @@ if __name__ == "__main__":
         type=str,
         default="./failed_to_download.log"
     )
+    parser.add_argument(
+        "--conversion_failed_output_log",
+        type=str,
+        default="./failed_to_convert_abstract.log",
+        help="Articles whose PDF has been downloaded but whose abstract could not be converted to text."
+    )
+    parser.add_argument(
+        "--latex_workers",
+        type=int,
+        default=-1,
+        help="Number of processes converting abstracts from LaTeX to text. If -1, abstracts are "\
+            "converted in the main process."
+    )
+    parser.add_argument(
+        "--latex_batch_size",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--latex_cache",
+        type=str,
+        default="./latex_cache.db",
+        help="Database caching the conversion of each abstract."
+    )
     parser.add_argument(
         "--n_docs",
         type=int,
@@ -210,12 +275,18 @@ if __name__ == "__main__":
             f"Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    if args.metadata_file is None and (args.metadata_db is None or not os.path.isfile(args.metadata_db)):
+        raise ValueError(
+            "--metadata_file is required if --metadata_db is not given or does not exist."
+        )
+
     if (os.listdir(args.pdf_output_dir) or os.path.exists(args.abstract_output_path)) and not args.resume:
         if args.overwrite_output_dir: 
             overwrite_dir_if_exists(args.pdf_output_dir)
             del_file_if_exists(args.abstract_output_path)
             del_file_if_exists(args.downloaded_output_log)
             del_file_if_exists(args.failed_output_log)
+            del_file_if_exists(args.conversion_failed_output_log)
         else:
             if os.listdir(args.pdf_output_dir):
                 raise ValueError(
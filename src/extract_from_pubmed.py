@@ -1,13 +1,17 @@
 import argparse 
+import asyncio
 import os 
-import subprocess
+import shutil
 import tarfile 
 import json
 from tqdm import tqdm
 import xml.etree.ElementTree as ET
 import urllib.request
+import urllib.error
+import http.client
 import logging
-from pylatexenc.latex2text import LatexNodes2Text 
+from concurrent.futures import ThreadPoolExecutor
+from src.latex_to_text import AbstractConverter
 from src.utils import (
     del_file_if_exists,
     get_ids_from_arxiv_or_pubmed, 
@@ -20,6 +24,9 @@ import zlib
 
 logging.disable(logging.CRITICAL)
 
+OA_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi"
+BIOC_URL = "https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_xml/{}/unicode"
+
 def extract_abstract(url):
     """ Extract abstract using the BioC API
 
@@ -38,34 +45,45 @@ def extract_abstract(url):
         abstract_text = " ".join(a.text for a in abstract_nodes)
         return abstract_text
 
-def extract_pdf_from_tar_url(url, output_path, tar_path):
-    """ Extract PDF from tar archive 
+def extract_pdf_from_tar_url(url, output_path):
+    """ Extract PDF from tar archive, streamed from its URL. Reading stops once the 
+        first PDF member has been written, so the rest of the package (figures, XML) 
+        is never downloaded.
 
     Args:
         url (string): FTP link to tar archive containing PDF
         output_path (string): Path to output PDF file
-        tar_path (string): Path to tar archive
 
     Returns:
         bool: True if extraction was successful, False otherwise
     """
-    command = f"wget -q -O {tar_path} {url}"
-    subprocess.call(command, shell=True)
-
-    tar = tarfile.open(tar_path)
+    tmp_path = output_path + ".tmp"
     try:
-        pdf_fname = [t.name for t in tar.getmembers() if ".pdf" in t.name]
-    except zlib.error:
+        with urllib.request.urlopen(url) as response, tarfile.open(fileobj=response, mode="r|gz") as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(".pdf"):
+                    with open(tmp_path, "wb") as fw:
+                        shutil.copyfileobj(tar.extractfile(member), fw)
+                    os.replace(tmp_path, output_path)
+                    return True
+    except (tarfile.TarError, zlib.error, EOFError):
         return False
-
-    if len(pdf_fname) == 1:
-        pdf_contents = tar.extractfile(pdf_fname[0]).read()
-        with open(output_path, "wb") as fw:
-            fw.write(pdf_contents)
-        os.remove(tar_path)
-        return True 
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     return False 
 
+def select_link(record):
+    """ Get the link to the PDF of an OA record, or to its package if there is no PDF """
+    links = record.findall(".//link")
+    if len(links) > 1:
+        pdf_link = record.find('.//link[@format="pdf"]')
+        return pdf_link.get("href") if pdf_link is not None else None
+    elif len(links) == 1:
+        return links[0].get("href")
+    else:
+        return None
+
 def find_ftp_url(oa_url):
     """ Extract FTP URL from PMC OA URL (https://www.ncbi.nlm.nih.gov/pmc/tools/ftp/)
 
@@ -77,14 +95,147 @@ def find_ftp_url(oa_url):
     """
     response = urllib.request.urlopen(oa_url).read()
     tree = ET.fromstring(response)
+    return select_link(tree)
 
-    links = tree.findall(".//link")    
-    if len(links) > 1:
-        return tree.find('.//link[@format="pdf"]').get("href")
-    elif len(links) == 1:
-        return links[0].get("href")
-    else:
-        return None
+def find_ftp_urls(oa_base_url, pmcids):
+    """ Extract the FTP URLs of several articles with a single OA request, the records
+        being matched to articles by their id attribute
+
+    Args:
+        oa_base_url (string): URL of the OA web service
+        pmcids (list): PMCIDs of the articles
+
+    Returns:
+        dict: PMCID -> link to the article location on the FTP site, for articles that have one
+    """
+    response = urllib.request.urlopen(f"{oa_base_url}?id={','.join(pmcids)}").read()
+    tree = ET.fromstring(response)
+    ftp_urls = {}
+    for record in tree.findall(".//record"):
+        ftp_url = select_link(record)
+        if ftp_url:
+            ftp_urls[record.get("id")] = ftp_url
+    return ftp_urls
+
+def download_pdf(ftp_url, output_path):
+    """ Download the PDF of an article, directly or from its package
+
+    Returns:
+        bool: True if extraction was successful, False otherwise
+    """
+    if ".pdf" in ftp_url:
+        return extract_pdf(ftp_url, output_path)
+    return extract_pdf_from_tar_url(ftp_url, output_path)
+
+
+def save_abstracts(args, converted):
+    """ Save converted abstracts and log the result. Abstracts that could not be converted
+        are logged separately from download failures.
+
+    Returns:
+        int: Number of abstracts that could not be converted
+    """
+    num_fails = 0
+    for pmcid, abstract_text in converted:
+        if abstract_text is None:
+            num_fails += 1
+            with open(args.conversion_failed_output_log, "a") as f:
+                f.write(pmcid + "\n")
+            continue
+        with open(args.abstract_output_path, "a") as outfile:
+            json.dump(
+                {"id": pmcid, "abstract": abstract_text}, 
+                outfile
+            )
+            outfile.write('\n')
+        with open(args.downloaded_output_log, "a") as f:
+            f.write(pmcid + "\n")
+    return num_fails
+
+
+async def _fetch(semaphore, func, *args):
+    """ Run a blocking request in a thread, once a slot of its endpoint is free
+
+    Returns:
+        Result of func, or None if the request failed
+    """
+    async with semaphore:
+        try:
+            return await asyncio.to_thread(func, *args)
+        except (
+            urllib.error.URLError, http.client.HTTPException, OSError, ValueError, ET.ParseError, tarfile.TarError, zlib.error
+        ):
+            return None
+
+
+async def fetch_articles(args, id_list, converter):
+    """ Fetch articles by chunks of --chunk_size. In each chunk, BioC abstracts are fetched 
+        first, and OA lookups and PDF downloads are only done for articles that have an 
+        abstract. Each endpoint has its own concurrency limit. Logs are written from the 
+        event loop only.
+
+    Returns:
+        tuple: Number of articles that could not be extracted, number of abstracts that 
+               could not be converted
+    """
+    bioc_semaphore = asyncio.Semaphore(args.bioc_concurrency)
+    oa_semaphore = asyncio.Semaphore(args.oa_concurrency)
+    pdf_semaphore = asyncio.Semaphore(args.pdf_concurrency)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(args.bioc_concurrency + args.oa_concurrency + args.pdf_concurrency)
+    )
+
+    num_fails = 0
+    num_conversion_fails = 0
+    with tqdm(total=len(id_list)) as pbar:
+        for i in range(0, len(id_list), args.chunk_size):
+            chunk = id_list[i: i+args.chunk_size]
+
+            abstracts = await asyncio.gather(*(
+                _fetch(bioc_semaphore, extract_abstract, args.bioc_url.format(pmcid)) for pmcid in chunk
+            ))
+            with_abstract = [pmcid for pmcid, abstract_text in zip(chunk, abstracts) if abstract_text]
+
+            if args.oa_batch_size > 1:
+                oa_batches = [
+                    with_abstract[j: j+args.oa_batch_size] for j in range(0, len(with_abstract), args.oa_batch_size)
+                ]
+                oa_results = await asyncio.gather(*(
+                    _fetch(oa_semaphore, find_ftp_urls, args.oa_url, batch) for batch in oa_batches
+                ))
+                ftp_urls = {}
+                for result in oa_results:
+                    ftp_urls.update(result or {})
+            else:
+                oa_results = await asyncio.gather(*(
+                    _fetch(oa_semaphore, find_ftp_url, f"{args.oa_url}?id={pmcid}") for pmcid in with_abstract
+                ))
+                ftp_urls = dict(zip(with_abstract, oa_results))
+
+            to_download = [pmcid for pmcid in with_abstract if ftp_urls.get(pmcid)]
+            downloaded = await asyncio.gather(*(
+                _fetch(
+                    pdf_semaphore, 
+                    download_pdf, 
+                    ftp_urls[pmcid], 
+                    os.path.join(args.pdf_output_dir, pmcid + ".pdf")
+                )
+                for pmcid in to_download
+            ))
+            downloaded = {pmcid for pmcid, pdf_extracted in zip(to_download, downloaded) if pdf_extracted}
+
+            for pmcid, abstract_text in zip(chunk, abstracts):
+                if pmcid in downloaded:
+                    converter.submit(pmcid, abstract_text.replace("\n", " "))
+                else:
+                    num_fails += 1
+                    with open(args.failed_output_log, "a") as f:
+                        f.write(pmcid + "\n")
+            num_conversion_fails += save_abstracts(args, converter.poll())
+            pbar.update(len(chunk))
+
+    num_conversion_fails += save_abstracts(args, converter.poll(wait=True))
+    return num_fails, num_conversion_fails
 
 
 def extract(args):
@@ -95,57 +246,23 @@ def extract(args):
         id_list = remove_processed_from_id_list(
             id_list, args.downloaded_output_log, args.failed_output_log
         )
+        id_list = remove_processed_from_id_list(id_list, args.conversion_failed_output_log)
 
         if not id_list:
             print(f"All articles in {args.input_file} have already been extracted")
             return 
 
     print(f"Extracting {len(id_list)} articles from PubMed, using IDs in {args.input_file}")
-    num_fails = 0
+    converter = AbstractConverter(
+        cache_path=args.latex_cache, num_workers=args.latex_workers, batch_size=args.latex_batch_size
+    )
     
-    for pmcid in tqdm(id_list):
-        failed_extraction = False
-
-        oa_url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id={pmcid}"
-        ftp_url = find_ftp_url(oa_url)
-        output_path = os.path.join(args.pdf_output_dir, pmcid + ".pdf")
-
-        if not ftp_url:
-            pdf_extracted = False
-        elif ".pdf" in ftp_url:
-            pdf_extracted = extract_pdf(ftp_url, output_path) 
-        else:
-            tar_path = os.path.join(args.extract_output_dir, pmcid + ".tar.gz")
-
-            pdf_extracted = extract_pdf_from_tar_url(ftp_url, output_path, tar_path)
-
-        if pdf_extracted:
-            abstract_text = extract_abstract(
-                f"https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_xml/{pmcid}/unicode"
-            )
-            if abstract_text: 
-                abstract_text = LatexNodes2Text().latex_to_text(abstract_text.replace("\n", " "))
-                with open(args.abstract_output_path, "a") as outfile:
-                    json.dump(
-                        {"id": pmcid, "abstract": abstract_text}, 
-                        outfile
-                    )
-                    outfile.write('\n')
-            else:
-                failed_extraction = True 
-                os.remove(output_path) # pdf has been extracted, delete it
-        else:
-            failed_extraction = True
-
-        if failed_extraction:
-            num_fails += 1
-            with open(args.failed_output_log, "a") as f:
-                f.write(pmcid + "\n")
-        else:
-            with open(args.downloaded_output_log, "a") as f:
-                f.write(pmcid + "\n")
+    num_fails, num_conversion_fails = asyncio.run(fetch_articles(args, id_list, converter))
+    converter.close()
         
-    print(f"Extracted abstract and PDF for {len(id_list) - num_fails}/{len(id_list)} articles.")
+    print(f"Extracted abstract and PDF for {len(id_list) - num_fails - num_conversion_fails}/{len(id_list)} articles.")
+    if num_conversion_fails:
+        print(f"{num_conversion_fails} abstracts could not be converted to text, see {args.conversion_failed_output_log}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -166,11 +283,6 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
-    parser.add_argument(
-        "--extract_output_dir", 
-        type=str,
-        default="./tmp",
-    )
     parser.add_argument(
         "--downloaded_output_log",
         type=str,
@@ -181,6 +293,73 @@ if __name__ == "__main__":
         type=str,
         default="./failed_to_download.log"
     )
+    parser.add_argument(
+        "--conversion_failed_output_log",
+        type=str,
+        default="./failed_to_convert_abstract.log",
+        help="Articles whose PDF has been downloaded but whose abstract could not be converted to text."
+    )
+    parser.add_argument(
+        "--latex_workers",
+        type=int,
+        default=-1,
+        help="Number of processes converting abstracts from LaTeX to text. If -1, abstracts are "\
+            "converted in the main process."
+    )
+    parser.add_argument(
+        "--latex_batch_size",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--latex_cache",
+        type=str,
+        default="./latex_cache.db",
+        help="Database caching the conversion of each abstract."
+    )
+    parser.add_argument(
+        "--oa_url",
+        type=str,
+        default=OA_URL,
+        help="OA web service, queried for the location of each article."
+    )
+    parser.add_argument(
+        "--bioc_url",
+        type=str,
+        default=BIOC_URL,
+        help="BioC API, {} being replaced by the PMCID."
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=100,
+        help="Number of articles fetched concurrently."
+    )
+    parser.add_argument(
+        "--bioc_concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of concurrent requests to the BioC API."
+    )
+    parser.add_argument(
+        "--oa_concurrency",
+        type=int,
+        default=2,
+        help="Maximum number of concurrent requests to the OA web service."
+    )
+    parser.add_argument(
+        "--pdf_concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of concurrent PDF or package downloads."
+    )
+    parser.add_argument(
+        "--oa_batch_size",
+        type=int,
+        default=1,
+        help="Number of PMCIDs per OA request, passed as a comma-separated id parameter. "\
+            "If 1, each article is looked up separately."
+    )
     parser.add_argument(
         "--n_docs",
         type=int,
@@ -204,15 +383,20 @@ if __name__ == "__main__":
             f"Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    if min(args.bioc_concurrency, args.oa_concurrency, args.pdf_concurrency, args.chunk_size, args.oa_batch_size) < 1:
+        raise ValueError(
+            "--chunk_size, --oa_batch_size and the concurrency limits must be positive."
+        )
+
     if (
-        os.listdir(args.pdf_output_dir) or os.path.exists(args.abstract_output_path) or os.path.exists(args.extract_output_dir)
+        os.listdir(args.pdf_output_dir) or os.path.exists(args.abstract_output_path)
     ) and not args.resume:
         if args.overwrite_output_dir:
             overwrite_dir_if_exists(args.pdf_output_dir)
-            overwrite_dir_if_exists(args.extract_output_dir)
             del_file_if_exists(args.abstract_output_path)
             del_file_if_exists(args.downloaded_output_log)
             del_file_if_exists(args.failed_output_log)
+            del_file_if_exists(args.conversion_failed_output_log)
         else:
             if os.listdir(args.pdf_output_dir):
                 raise ValueError(
@@ -222,9 +406,5 @@ if __name__ == "__main__":
                 raise ValueError(
                     f"Output file ({args.abstract_output_path}) already exists and is not empty. Use --overwrite_output_dir to overcome."
                 )
-            if os.listdir(args.extract_output_dir):
-                raise ValueError(
-                    f"Output directory ({args.extract_output_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
-                )
 
     extract(args)
\ No newline at end of file
@@ -2,19 +2,18 @@ import argparse
 import os 
 from tqdm import tqdm
 import shutil
-from pathlib import Path
+from src.utils import Document, list_files
 
 def filter_out(args):
-    input_files = list(Path(args.input_dir).rglob("*.txt"))
+    input_files = list_files(args.input_dir, ".txt", recursive=True)
 
     for input_path in tqdm(input_files):
         filename = os.path.basename(os.path.normpath(input_path))
         output_path = os.path.join(args.output_dir, filename)
-        with open(input_path, 'r') as input_file:
-            doc_length = sum(1 for line in input_file)
-            if doc_length >= args.lower_bound:
-                if args.upper_bound < 0 or doc_length <= args.upper_bound:
-                    shutil.copy(input_path, output_path)
+        doc_length = Document(input_path).num_words
+        if doc_length >= args.lower_bound:
+            if args.upper_bound < 0 or doc_length <= args.upper_bound:
+                shutil.copy(input_path, output_path)
 
 
 if __name__ == "__main__":
@@ -4,7 +4,7 @@ import argparse
 import os
 import numpy as np
 import matplotlib.pyplot as plt
-from pathlib import Path
+from src.utils import list_files, get_doc_id
 
 def get_abs_length(
     abstract_file, 
@@ -13,8 +13,8 @@ def get_abs_length(
     file_extension=None,
 ):
     if input_folder is not None and file_extension is not None:
-        input_files = list(Path(input_folder).rglob(f"*.{file_extension}"))
-        valid_ids = [os.path.basename(os.path.normpath(fname))[:-(len(file_extension)+1)] for fname in input_files]
+        input_files = list_files(input_folder, f".{file_extension}", recursive=True)
+        valid_ids = set(get_doc_id(os.path.basename(fname), f".{file_extension}") for fname in input_files)
 
     all_abs_length = []
     len_valid = 0
@@ -3,45 +3,37 @@ import argparse
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import numpy as np
-import PyPDF2
-from PyPDF2 import PdfFileReader
 from pathlib import Path
+from src.utils import Document, list_files
+from src.pdf_probe import probe_pdf_cached
 
-def count_num_pages_from_pdf(input_folder):
+def count_num_pages_from_pdf(input_folder, probe_cache=None):
     # input_files = os.listdir(input_folder)
     input_files = list(Path(input_folder).rglob("*.pdf"))
 
     all_num_pages = []
 
     for fpath in tqdm(input_files):
-        try:
-            # with open(os.path.join(input_folder, fpath), "rb") as pdf_file:
-            with open(fpath, 'rb') as pdf_file:
-                pdf_reader = PdfFileReader(pdf_file, strict=False)
-                all_num_pages.append(pdf_reader.numPages)
-        except (PyPDF2.utils.PdfReadError, OSError, KeyError, ValueError, TypeError, AssertionError):
-            continue 
+        probe = probe_pdf_cached(str(fpath), db_path=probe_cache)
+        if probe["valid"]:
+            all_num_pages.append(probe["num_pages"])
 
     return all_num_pages
 
 def count_num_pages_from_txt(input_folder):
     # input_files = os.listdir(input_folder)
-    input_files = list(Path(input_folder).rglob("*.txt"))
+    input_files = list_files(input_folder, ".txt", recursive=True)
 
     all_num_pages = []
 
     for fpath in tqdm(input_files):
-        # with open(os.path.join(input_folder, fpath), "r") as f:
-        with open(fpath, 'r') as f:
-            lines = f.readlines()
-        last_page = int(lines[-1].split("\t")[-1])
-        all_num_pages.append(last_page)
+        all_num_pages.append(Document(fpath).num_pages)
 
     return all_num_pages
 
 def get_stats(args):
     if args.file_extension == "pdf":
-        all_num_pages = count_num_pages_from_pdf(args.input_folder)
+        all_num_pages = count_num_pages_from_pdf(args.input_folder, probe_cache=args.probe_cache)
     elif args.file_extension == "txt":
         all_num_pages = count_num_pages_from_txt(args.input_folder)
     else:
@@ -81,6 +73,11 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
+    parser.add_argument(
+        "--probe_cache",
+        type=str,
+        default="./pdf_probe.db",
+    )
     parser.add_argument(
         "--plot_hist", 
         action="store_true", 
@@ -0,0 +1,154 @@
+import hashlib
+import sqlite3
+from multiprocessing import Pool
+from pylatexenc.latex2text import LatexNodes2Text
+
+_converter = None
+
+
+def get_converter():
+    """ Get the LatexNodes2Text instance of the current process """
+    global _converter
+    if _converter is None:
+        _converter = LatexNodes2Text()
+    return _converter
+
+
+def latex_to_text(latex):
+    """ Convert LaTeX to text
+
+    Returns:
+        string: Text, or None if the conversion failed
+    """
+    try:
+        return get_converter().latex_to_text(latex)
+    except (IndexError, ValueError, RecursionError):
+        return None
+
+
+def convert_batch(latex_list):
+    return [latex_to_text(latex) for latex in latex_list]
+
+
+class LatexCache:
+    """ Persistent table of conversions, keyed by the hash of the LaTeX source. Failed
+        conversions are stored too, so they are not retried.
+
+    Args:
+        db_path (string): Path to SQLite database, or None to only keep conversions in memory
+    """
+
+    def __init__(self, db_path=None):
+        self.memory = {}
+        self.conn = None
+        if db_path is not None:
+            self.conn = sqlite3.connect(db_path, timeout=60)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS latex_cache (hash TEXT PRIMARY KEY, text TEXT, ok INTEGER)")
+            self.conn.commit()
+
+    def get(self, key):
+        """ Returns (found, text) """
+        if key in self.memory:
+            return True, self.memory[key]
+        if self.conn is not None:
+            row = self.conn.execute("SELECT text, ok FROM latex_cache WHERE hash = ?", (key,)).fetchone()
+            if row is not None:
+                return True, row[0] if row[1] else None
+        return False, None
+
+    def put_many(self, items):
+        if self.conn is not None:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO latex_cache VALUES (?, ?, ?)",
+                [(key, text, int(text is not None)) for key, text in items]
+            )
+            self.conn.commit()
+        else:
+            self.memory.update(items)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class AbstractConverter:
+    """ Convert LaTeX abstracts to text, in a process pool and by batches, while the caller
+        keeps downloading. Results are memoised by the hash of the abstract.
+
+    Usage:
+        converter.submit(doc_id, latex)
+        for doc_id, text in converter.poll(): # text is None if the conversion failed
+            ...
+        converter.poll(wait=True) # remaining results
+        converter.close()
+
+    Args:
+        cache_path (string): Path to SQLite cache, or None to only cache in memory
+        num_workers (int): Number of processes. If -1, abstracts are converted in the
+                           calling process.
+        batch_size (int): Number of abstracts sent to a process at once
+    """
+
+    def __init__(self, cache_path=None, num_workers=-1, batch_size=64):
+        self.cache = LatexCache(cache_path)
+        self.pool = Pool(num_workers) if num_workers > 0 else None
+        self.batch_size = batch_size
+        self.buffer = []
+        self.pending = []
+        self.ready = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, doc_id, latex):
+        key = hashlib.sha1(latex.encode("utf-8")).hexdigest()
+        found, text = self.cache.get(key)
+        if found:
+            self.ready.append((doc_id, text))
+            return
+        self.buffer.append((doc_id, key, latex))
+        if len(self.buffer) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        latex_list = [latex for _, _, latex in batch]
+        if self.pool is not None:
+            self.pending.append((batch, self.pool.apply_async(convert_batch, (latex_list,))))
+        else:
+            self._store(batch, convert_batch(latex_list))
+
+    def _store(self, batch, texts):
+        self.cache.put_many([(key, text) for (_, key, _), text in zip(batch, texts)])
+        self.ready.extend((doc_id, text) for (doc_id, _, _), text in zip(batch, texts))
+
+    def poll(self, wait=False):
+        """ Get the conversions that are done, or every submitted conversion if wait
+
+        Returns:
+            list: (doc_id, text) tuples, text being None if the conversion failed
+        """
+        if wait:
+            self._flush()
+        pending = []
+        for batch, result in self.pending:
+            if wait or result.ready():
+                self._store(batch, result.get())
+            else:
+                pending.append((batch, result))
+        self.pending = pending
+
+        ready, self.ready = self.ready, []
+        return ready
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.cache.close()
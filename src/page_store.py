@@ -0,0 +1,237 @@
+import argparse
+import mmap
+import os
+import sqlite3
+from tqdm import tqdm
+from src.utils import (
+    find_archive,
+    iter_archive_members,
+    ARCHIVE_EXTENSIONS,
+)
+
+INDEX_NAME = "index.db"
+
+
+def get_shard_name(shard):
+    return f"shard-{shard:05d}.bin"
+
+
+def get_page_num(member):
+    """ Get page number from the name of a page image, e.g. "id/id-3.jpg" -> 3 """
+    fname = os.path.basename(member)
+    return int(os.path.splitext(fname)[0].rsplit("-", 1)[1])
+
+
+def _connect(store_dir):
+    conn = sqlite3.connect(os.path.join(store_dir, INDEX_NAME), timeout=60)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS pages ("
+        "doc_id TEXT, page INTEGER, name TEXT, shard INTEGER, offset INTEGER, length INTEGER, "
+        "PRIMARY KEY (doc_id, page))"
+    )
+    conn.commit()
+    return conn
+
+
+class PageStoreWriter:
+    """ Append page images to large shard files, indexed by (doc_id, page)
+
+    Shards are only ever appended to. A document is indexed once all its pages have
+    been written, so an interrupted export can be resumed. Adding a document again
+    replaces its pages in the index, the previous bytes being left unused in the shards.
+
+    Args:
+        store_dir (string): Folder containing the shards and the index
+        shard_size (int): Size (in MB) after which a new shard is started
+    """
+
+    def __init__(self, store_dir, shard_size=1024):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.shard_size = shard_size * 1024 * 1024
+        self.conn = _connect(store_dir)
+        last_shard = self.conn.execute("SELECT MAX(shard) FROM pages").fetchone()[0]
+        self.shard = last_shard if last_shard is not None else 0
+        self.shard_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open_shard(self):
+        if self.shard_file is None:
+            self.shard_file = open(os.path.join(self.store_dir, get_shard_name(self.shard)), "ab")
+        if self.shard_file.tell() > 0 and self.shard_file.tell() >= self.shard_size:
+            self.shard_file.close()
+            self.shard += 1
+            self.shard_file = open(os.path.join(self.store_dir, get_shard_name(self.shard)), "ab")
+        return self.shard_file
+
+    def contains(self, doc_id):
+        return self.conn.execute("SELECT 1 FROM pages WHERE doc_id = ? LIMIT 1", (doc_id,)).fetchone() is not None
+
+    def add_document(self, doc_id, archive_path):
+        """ Add the pages of a document, stored in an archive written by convert_pdf_to_image """
+        rows = []
+        shard_file = self._open_shard()
+        for member, content in iter_archive_members(archive_path):
+            offset = shard_file.tell()
+            shard_file.write(content)
+            rows.append((doc_id, get_page_num(member), os.path.basename(member), self.shard, offset, len(content)))
+        shard_file.flush()
+        os.fsync(shard_file.fileno())
+
+        with self.conn:
+            self.conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+            self.conn.executemany("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        self.conn.close()
+
+
+class PageStore:
+    """ Read page images from a store written by PageStoreWriter. Shards are memory-mapped
+        lazily, once per process, so a PageStore can be shared by data loader workers.
+
+    Args:
+        store_dir (string): Folder containing the shards and the index
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        conn = _connect(store_dir)
+        self.index = {
+            (doc_id, page): (name, shard, offset, length)
+            for doc_id, page, name, shard, offset, length in conn.execute(
+                "SELECT doc_id, page, name, shard, offset, length FROM pages"
+            )
+        }
+        conn.close()
+        self._pid = None
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return sorted(self.index)
+
+    def _get_shard(self, shard):
+        if self._pid != os.getpid():
+            # mappings are not inherited from a parent process
+            self._pid = os.getpid()
+            self._shards = {}
+        if shard not in self._shards:
+            with open(os.path.join(self.store_dir, get_shard_name(shard)), "rb") as f:
+                self._shards[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._shards[shard]
+
+    def get_name(self, doc_id, page):
+        return self.index[(doc_id, page)][0]
+
+    def get_page(self, doc_id, page):
+        """ Get the encoded image of a page
+
+        Returns:
+            bytes: Image content (JPEG or WebP)
+        """
+        _, shard, offset, length = self.index[(doc_id, page)]
+        return self._get_shard(shard)[offset:offset+length]
+
+    def close(self):
+        for shard in self._shards.values():
+            shard.close()
+        self._shards = {}
+
+
+def export(args):
+    archives = sorted(os.listdir(args.img_dir))
+    archives = archives[:args.n_docs] if args.n_docs > 0 else archives
+
+    with PageStoreWriter(args.store_dir, shard_size=args.shard_size) as writer:
+        for fname in tqdm(archives, desc=f"Exporting pages from {args.img_dir} to {args.store_dir}"):
+            doc_id = fname
+            for ext in ARCHIVE_EXTENSIONS.values():
+                if ext and fname.endswith(ext):
+                    doc_id = fname[:-len(ext)]
+                    break
+            if writer.contains(doc_id):
+                continue
+            writer.add_document(doc_id, os.path.join(args.img_dir, fname))
+
+
+def verify(args):
+    """ Check that every page of the store matches the per-document archives """
+    store = PageStore(args.store_dir)
+    pages_by_doc = {}
+    for doc_id, page in store.keys():
+        pages_by_doc.setdefault(doc_id, []).append(page)
+
+    num_errors = 0
+    for doc_id, pages in tqdm(pages_by_doc.items(), desc=f"Verifying {args.store_dir}"):
+        archive_path = find_archive(args.img_dir, doc_id)
+        if archive_path is None:
+            print(f"{doc_id}: archive not found in {args.img_dir}")
+            num_errors += 1
+            continue
+        archive_pages = {
+            get_page_num(member): content for member, content in iter_archive_members(archive_path)
+        }
+        if sorted(archive_pages) != sorted(pages):
+            print(f"{doc_id}: pages differ from {archive_path}")
+            num_errors += 1
+            continue
+        for page in sorted(archive_pages):
+            if store.get_page(doc_id, page) != archive_pages[page]:
+                print(f"{doc_id}: page {page} differs from {archive_path}")
+                num_errors += 1
+    store.close()
+
+    print(f"{len(store)} pages of {len(pages_by_doc)} documents verified, {num_errors} errors")
+    return num_errors == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--img_dir",
+        type=str,
+        required=True,
+        help="Output directory of convert_pdf_to_image, in any archive format."
+    )
+    parser.add_argument(
+        "--store_dir",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=1024,
+        help="Size (in MB) after which a new shard is started."
+    )
+    parser.add_argument(
+        "--n_docs",
+        type=int,
+        default=-1,
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the store against the archives in --img_dir instead of exporting."
+    )
+
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args)
+    else:
+        export(args)
@@ -1,11 +1,27 @@
 import os
+import sys
 import shutil
 import argparse
+from functools import lru_cache
 from tqdm import tqdm
 from lxml.etree import iterparse
 import re
 import logging
-from src.utils import remove_processed_from_id_list, compress_dir
+import numpy as np
+from src.utils import (
+    remove_processed_from_id_list, 
+    compress_dir, 
+    get_file_signature, 
+    del_file_if_exists,
+    open_file,
+    get_doc_id,
+    find_file,
+    add_compression_ext,
+    list_files,
+    load_records,
+    append_record,
+    compact_records,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,15 +32,59 @@ REF_MAPPING = {
     "it": ["bibliografia"],
     "pt": ["referências", "bibliografia"],
     "ru": ["литература"],
+    "ko": ["참고문헌", "참고 문헌"],
 }
 
+EN_REF_HEADINGS = ["references", "bibliography", "literature cited", "works cited"]
+
+# Reference headers on the first pages (cover page, table of contents) are ignored
+REF_MIN_PAGE_INDEX = 1
+
+# A line is a reference header if it only contains one of the headings, optionally
+# preceded by a section number (e.g. "7.", "VII.") and followed by a colon
+REF_HEADER_PATTERN = re.compile(
+    r"^(?:(?:[0-9]+|[ivxlc]+)(?:\.\s*|\s+))?(?:"
+    + "|".join(
+        re.escape(heading)
+        for heading in sorted(
+            set(EN_REF_HEADINGS + [h for headings in REF_MAPPING.values() for h in headings]),
+            key=len,
+            reverse=True,
+        )
+    )
+    + r")\s*:?$",
+    re.IGNORECASE,
+)
+
+SPECIAL_CHARS_PATTERN = re.compile('[^a-zA-Z0-9*\s]')
+
+# Quotes and ligatures commonly produced by pdftotext on SciELO/KoreaScience PDFs
+CHAR_MAPPING = {
+    "‘": "'", "’": "'", "‚": "'", "‛": "'",
+    "“": '"', "”": '"', "„": '"', "‟": '"',
+    "ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl", "ﬅ": "st", "ﬆ": "st",
+    "\u00ad": "", "\u200b": "", "\u200c": "", "\u200d": "", "\ufeff": "",
+}
+# all Unicode whitespace characters lie in the BMP
+CHAR_MAPPING.update({chr(c): "" for c in range(0x10000) if chr(c).isspace()})
+WORD_TRANSLATION_TABLE = str.maketrans(CHAR_MAPPING)
+
+WORD_CACHE_SIZE = 2 ** 18
+
 def remove_special_chars(text):
-    return re.sub('[^a-zA-Z0-9*\s]', '', text)
+    return SPECIAL_CHARS_PATTERN.sub('', text)
 
+@lru_cache(maxsize=WORD_CACHE_SIZE)
 def clean_text(text):
-    text = re.sub(r"\s+", "", text)
-    text = re.sub(r"’", "'", text)
-    return text
+    """ Normalize a word and intern it, so that repeated words share the same string
+
+    Args:
+        text (string): Raw word text
+
+    Returns:
+        string: Word without whitespace, with normalized quotes and ligatures
+    """
+    return sys.intern(text.translate(WORD_TRANSLATION_TABLE))
 
 def normalize_bbox(bbox, size):
     return (
@@ -34,9 +94,54 @@ def normalize_bbox(bbox, size):
         int(1000 * bbox[3] / size[1]),
     )
 
+def normalize_bboxes(bboxes, size):
+    """ Vectorized version of normalize_bbox for a (num_words, 4) array of int bboxes """
+    return (1000 * bboxes) // np.array([size[0], size[1], size[0], size[1]], dtype=bboxes.dtype)
+
+def clamp_bboxes(raw_coords, page_width, page_height):
+    """ Round bbox coordinates, clamp them to the page and order min/max coordinates
+
+    Args:
+        raw_coords (list): Flat list of xMin, yMin, xMax, yMax values (strings or floats)
+        page_width (int): Page width
+        page_height (int): Page height
+
+    Returns:
+        np.ndarray: (num_words, 4) array of xmin, ymin, xmax, ymax
+    """
+    bboxes = np.rint(np.array(raw_coords, dtype=np.float64)).astype(np.int64).reshape(-1, 4)
+    np.clip(bboxes[:, 0::2], 0, page_width, out=bboxes[:, 0::2])
+    np.clip(bboxes[:, 1::2], 0, page_height, out=bboxes[:, 1::2])
+
+    mins = np.minimum(bboxes[:, :2], bboxes[:, 2:]) # swap if min > max
+    maxs = np.maximum(bboxes[:, :2], bboxes[:, 2:])
+    return np.concatenate((mins, maxs), axis=1)
+
+def build_page(words, raw_coords, page_width, page_height, do_normalize_bbox=False):
+    """ Build a page from its words and the raw coordinates of their bboxes
+
+    Returns:
+        tuple: (words, bboxes, (page_width, page_height)), with bboxes a (num_words, 4) array
+    """
+    bboxes = clamp_bboxes(raw_coords, page_width, page_height)
+    if do_normalize_bbox:
+        bboxes = normalize_bboxes(bboxes, (page_width, page_height))
+    return (words, bboxes, (page_width, page_height))
+
+def format_page(page, page_number):
+    """ Format a page as lines of the token file """
+    words, bboxes, (page_width, page_height), _ = page
+    suffix = f"{page_width}\t{page_height}\t{page_number}\n"
+    return "".join(
+        f"{word}\t{bbox[0]}\t{bbox[1]}\t{bbox[2]}\t{bbox[3]}\t{suffix}"
+        for word, bbox in zip(words, bboxes.tolist())
+    )
+
+def is_ref_header(line_text):
+    return REF_HEADER_PATTERN.match(line_text) is not None
+
 def skip_first_page(page):
-    text = [elem[0] for elem in page]
-    text = " ".join(text)
+    text = " ".join(page[0])
 
     if "HAL is a multi-disciplinary open access archive" in text:
         return True 
@@ -44,57 +149,62 @@ def skip_first_page(page):
     return False
 
 def extract_text_from_tree(file_path, do_normalize_bbox=False, remove_ref=False):
+    """ Extract words and bboxes from a pdftotext bbox-layout HTML file
+
+    Returns:
+        list: Pages as (words, bboxes, (page_width, page_height), page_index) tuples, where 
+              page_index is the index of the page in the HTML file (empty pages are dropped),
+              or None if the document has no textual contents
+    """
     doc = []
+    num_html_pages = 0
 
-    cur_page = []
+    cur_words = []
+    cur_coords = []
     page_width = None
     page_height = None
     ref_page_idx = None
     ref_start_idx_in_page = None
+    line_start_idx = 0
 
-    with open(file_path, 'rb') as f:
-        for _, element in iterparse(f, events=("start", "end"), recover=True):
+    with open_file(file_path, 'rb') as f:
+        for event, element in iterparse(f, events=("start", "end"), recover=True):
             if "word" in element.tag and element.text:
                 word = clean_text(element.text) if element.text else None
                 if word:
                     if element.attrib:
                         if page_width == 0 or page_height == 0:
                             continue
-                        xmin = round(float(element.attrib['xMin']))
-                        xmax = round(float(element.attrib['xMax']))
-                        ymin = round(float(element.attrib['yMin']))
-                        ymax = round(float(element.attrib['yMax']))
-
-                        xmin, ymin = max(0, xmin), max(0, ymin) # set to 0 if < 0 
-                        xmax, ymax = min(page_width, xmax), min(page_height, ymax) # set to max if > max
-
-                        xmin = min(xmin, page_width) # set to max if > max 
-                        ymin = min(ymin, page_height) 
-                        xmax = max(0, xmax) # set to 0 if < 0
-                        ymax = max(0, ymax)
-
-                        if xmin > xmax: # swap if xmin > xmax
-                            xmin, xmax = xmax, xmin
-                        if ymin > ymax:
-                            ymin, ymax = ymax, ymin
-
-                        bbox = tuple([xmin, ymin, xmax, ymax])
-                        if do_normalize_bbox:
-                            bbox = normalize_bbox(bbox, (page_width, page_height))
-
-                        cur_page.append((word,) + bbox + (page_width, page_height))
+                        attrib = element.attrib
+                        cur_words.append(word)
+                        cur_coords.extend((attrib['xMin'], attrib['yMin'], attrib['xMax'], attrib['yMax']))
 
             elif "page" in element.tag and element.attrib:
-                if len(cur_page) > 0:
-                    doc.append(cur_page)
-                    cur_page = []
+                if len(cur_words) > 0:
+                    page = build_page(cur_words, cur_coords, page_width, page_height, do_normalize_bbox)
+                    doc.append(page + (num_html_pages - 1,))
+                    cur_words = []
+                    cur_coords = []
+                num_html_pages += 1
                 page_width = round(float(element.attrib["width"]))
                 page_height = round(float(element.attrib["height"]))
 
+            elif remove_ref and "line" in element.tag:
+                if event == "start":
+                    line_start_idx = len(cur_words)
+                elif len(cur_words) > line_start_idx and num_html_pages - 1 >= REF_MIN_PAGE_INDEX:
+                    line_text = " ".join(cur_words[line_start_idx:])
+                    if is_ref_header(line_text):
+                        # references start here, no need to parse the rest of the document
+                        ref_page_idx = len(doc)
+                        ref_start_idx_in_page = line_start_idx
+                        break
+
             element.clear()
 
-    if len(cur_page) > 0:
-        doc.append(cur_page)
+    if len(cur_words) > 0:
+        page = build_page(cur_words, cur_coords, page_width, page_height, do_normalize_bbox)
+        doc.append(page + (num_html_pages - 1,))
  
     if len(doc) > 0 and skip_first_page(doc[0]):
         doc = doc[1:]
@@ -102,75 +212,160 @@ def extract_text_from_tree(file_path, do_normalize_bbox=False, remove_ref=False)
             ref_page_idx -= 1
 
     if remove_ref and ref_page_idx is not None and ref_start_idx_in_page is not None:
-        # remove everything that follows references
-        doc = doc[: ref_page_idx+1] 
-        doc[ref_page_idx] = doc[ref_page_idx][: ref_start_idx_in_page] 
-
-    if any(doc): # no textual contents -> scanned document
+        if ref_page_idx < 0: # references started on the skipped first page
+            doc = []
+        else:
+            # remove everything that follows references
+            doc = doc[: ref_page_idx+1] 
+            words, bboxes, page_size, page_index = doc[ref_page_idx]
+            doc[ref_page_idx] = (words[: ref_start_idx_in_page], bboxes[: ref_start_idx_in_page], page_size, page_index)
+            if not ref_start_idx_in_page:
+                doc = doc[:-1]
+
+    if any(len(page[0]) > 0 for page in doc): # no textual contents -> scanned document
         return doc 
 
     return None
 
 
+PARSE_OPTIONS = ("do_normalize_bbox", "remove_ref", "compression", "first_page")
+
+def select_changed_docs(args, all_fnames, fnames, state, options):
+    """ Select documents whose input or parsing options changed since their last parse,
+        and remove outputs of documents whose input is gone
+
+    Returns:
+        list: File names of HTMLs to parse
+        dict: Signatures of the selected HTMLs
+    """
+    doc_ids = set(get_doc_id(fname, ".html") for fname in all_fnames)
+    for doc_id in sorted(set(state) - doc_ids):
+        print(f"Removing output of {doc_id} (input is gone)")
+        remove_output(args.output_dir, doc_id)
+        del state[doc_id]
+        append_record(args.state_file, {"id": doc_id, "removed": True})
+        append_record(args.page_index, {"id": doc_id, "removed": True})
+
+    to_parse = []
+    signatures = {}
+    for html in tqdm(fnames, desc=f"Checking HTMLs in {args.html_dir} for changes"):
+        doc_id = get_doc_id(html, ".html")
+        previous = state.get(doc_id)
+        signature = get_file_signature(os.path.join(args.html_dir, html), previous=previous)
+        if (
+            previous is not None 
+            and previous["hash"] == signature["hash"] 
+            and previous["options"] == options
+        ):
+            if previous["mtime"] != signature["mtime"]: # touched but unchanged
+                state[doc_id] = dict(previous, **signature)
+                append_record(args.state_file, state[doc_id])
+            continue
+        to_parse.append(html)
+        signatures[html] = signature
+
+    return to_parse, signatures
+
+def extract_page_texts(file_path):
+    """ Extract the text of every page of a pdftotext bbox-layout HTML file, 
+        including pages without words, so that page indices are preserved
+
+    Returns:
+        list: Text of each page
+    """
+    pages = []
+    with open_file(file_path, 'rb') as f:
+        for event, element in iterparse(f, events=("start", "end"), recover=True):
+            if "word" in element.tag and element.text:
+                word = clean_text(element.text)
+                if word and pages:
+                    pages[-1].append(word)
+            elif "page" in element.tag and event == "start":
+                pages.append([])
+            element.clear()
+    return [" ".join(words) for words in pages]
+
+
+def load_page_index(index_path):
+    """ Load the PDF page numbers of the pages of each token file
+
+    Returns:
+        dict: Document ID -> list of PDF page numbers, page i of the token file being 
+              page pdf_pages[i-1] of the PDF
+    """
+    return {doc_id: record["pages"] for doc_id, record in load_records(index_path).items()}
+
+
+def remove_output(output_dir, doc_id):
+    """ Remove the token file of a document, whatever its compression """
+    output_file = find_file(output_dir, doc_id, ".txt")
+    while output_file is not None:
+        del_file_if_exists(output_file)
+        output_file = find_file(output_dir, doc_id, ".txt")
+
+
 def parse(args):
-    fnames = sorted(os.listdir(args.html_dir))
-    fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
+    all_fnames = list_files(args.html_dir, ".html")
+    fnames = all_fnames[:args.n_docs] if args.n_docs > 0 else all_fnames 
 
     if args.resume:
         print("Resuming parsing...")
-        fnames = remove_processed_from_id_list(
-            fnames, args.parsed_output_log, args.failed_output_log
-        )
-        if not fnames:
-            print(f"All documents in {args.input_file} have already been parsed")
+        doc_ids = [get_doc_id(fname, ".html") for fname in fnames]
+        doc_ids = set(remove_processed_from_id_list(
+            doc_ids, args.parsed_output_log, args.not_parsed_output_log
+        ))
+        if not doc_ids:
+            print(f"All documents in {args.html_dir} have already been parsed")
             return
+        fnames = [fname for fname in fnames if get_doc_id(fname, ".html") in doc_ids]
+
+    if args.incremental:
+        options = {option: getattr(args, option) for option in PARSE_OPTIONS}
+        state = load_records(args.state_file)
+        # rewrite the logs, dropping lines left incomplete by an interrupted run
+        compact_records(args.state_file, state)
+        compact_records(args.page_index, load_records(args.page_index))
+        fnames, signatures = select_changed_docs(args, all_fnames, fnames, state, options)
+        print(f"{len(fnames)} documents in {args.html_dir} are new or have changed")
 
     for html in tqdm(fnames, desc=f"Parsing HTMLs from {args.html_dir}"):
         html_path = os.path.join(args.html_dir, html)
         doc = extract_text_from_tree(
             html_path, do_normalize_bbox=args.do_normalize_bbox, remove_ref=args.remove_ref
         )
-        doc_id = html.replace(".html", "")
+        doc_id = get_doc_id(html, ".html")
+
+        output_file = os.path.join(
+            os.path.join(args.output_dir, add_compression_ext(doc_id + ".txt", args.compression))
+        )
+        if args.incremental: # remove output from a previous parse
+            remove_output(args.output_dir, doc_id)
 
         if doc is None:
             with open(args.not_parsed_output_log, "a") as f:
                 f.write(doc_id + "\n")
+            append_record(args.page_index, {"id": doc_id, "removed": True})
         else:
-            output_file = os.path.join(
-                os.path.join(args.output_dir, doc_id + ".txt")
-            )
-            with open(output_file, "w", encoding="utf-8") as fw:
+            with open_file(output_file, "w", compression=args.compression) as fw:
                 for page_id, p in enumerate(doc):
-                    for elem in p:
-                        word = elem[0]
-                        bbox = elem[1:5]
-                        page_width, page_height = elem[5:]
-
-                        bbox_str = (
-                            str(bbox[0]) 
-                            + "\t" 
-                            + str(bbox[1]) 
-                            + "\t" 
-                            + str(bbox[2]) 
-                            + "\t" 
-                            + str(bbox[3])
-                        )
-
-                        fw.write(
-                            word 
-                            + "\t" 
-                            + bbox_str 
-                            + "\t" 
-                            + str(page_width) 
-                            + "\t" 
-                            + str(page_height) 
-                            + "\t"
-                            + str(page_id+1)
-                            + "\n" 
-                        )
+                    fw.write(format_page(p, page_id+1))
+
+            # page i of the token file is page pdf_pages[i-1] of the PDF
+            pdf_pages = [args.first_page + page_index for *_, page_index in doc]
+            append_record(args.page_index, {"id": doc_id, "pages": pdf_pages})
 
             with open(args.parsed_output_log, "a") as f:
                 f.write(doc_id + "\n")
+
+        if args.incremental:
+            state[doc_id] = dict(
+                {"id": doc_id, "parsed": doc is not None, "options": options}, **signatures[html]
+            )
+            append_record(args.state_file, state[doc_id])
+
+    if args.incremental:
+        compact_records(args.state_file, state)
+        compact_records(args.page_index, load_records(args.page_index))
                     
 
 if __name__ == "__main__":
@@ -215,6 +410,38 @@ if __name__ == "__main__":
         action="store_true", 
         help="Resume download."
     )
+    parser.add_argument(
+        "--compression", 
+        type=str,
+        choices=["gzip", "zstd"],
+        default=None,
+        help="Compress token files."
+    )
+    parser.add_argument(
+        "--first_page", 
+        type=int,
+        default=1,
+        help="First PDF page converted to HTML (--first_page of convert_pdf_to_html)."
+    )
+    parser.add_argument(
+        "--page_index",
+        type=str,
+        default="./page_index.jsonl",
+        help="File storing, for each document, the PDF page number of each page of its token file. "\
+            "Truncated at the start of each run, unless --resume or --incremental is used."
+    )
+    parser.add_argument(
+        "--incremental", 
+        action="store_true", 
+        help="Only parse documents whose HTML or parsing options changed since the last run, "\
+            "and remove outputs of documents whose HTML is gone."
+    )
+    parser.add_argument(
+        "--state_file",
+        type=str,
+        default="./parse_state.jsonl",
+        help="File storing, for each document, the signature of its HTML and the options used to parse it."
+    )
     parser.add_argument(
         "--overwrite_output_dir", 
         action="store_true", 
@@ -223,12 +450,12 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    if args.resume and args.overwrite_output_dir:
+    if sum([args.resume, args.incremental, args.overwrite_output_dir]) > 1:
         raise ValueError(
-            f"Cannot use --resume and --overwrite_output_dir at the same time."
+            "Only one of --resume, --incremental and --overwrite_output_dir can be used at a time."
         )
 
-    if os.listdir(args.output_dir) and not args.resume:
+    if os.listdir(args.output_dir) and not (args.resume or args.incremental):
         if args.overwrite_output_dir:
             print(f"Overwriting {args.output_dir}")
             shutil.rmtree(args.output_dir)
@@ -239,9 +466,15 @@ if __name__ == "__main__":
 
             print(f"Overwriting {args.not_parsed_output_log}")
             os.remove(args.not_parsed_output_log)
+
+            del_file_if_exists(args.state_file)
         else:
             raise ValueError(
                 f"Output directory ({args.output_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
             )
 
+    if not (args.resume or args.incremental):
+        # a fresh run must not extend the page index of another run or corpus
+        del_file_if_exists(args.page_index)
+
     parse(args)
\ No newline at end of file
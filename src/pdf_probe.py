@@ -0,0 +1,192 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import PyPDF2
+from PyPDF2 import PdfFileReader
+
+PDF_HEADER = b"%PDF-"
+HEADER_SEARCH_SIZE = 1024
+INVALID = {"num_pages": None, "encrypted": False, "valid": False}
+# not cached, the file is probed again next time
+TIMED_OUT = {"num_pages": None, "encrypted": False, "valid": False, "timed_out": True}
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYPDF2_PROBE_SCRIPT = (
+    "import json, sys; from src.pdf_probe import _probe_with_pypdf2; "
+    "print(json.dumps(_probe_with_pypdf2(sys.argv[1])))"
+)
+
+
+def _has_pdf_header(filepath):
+    with open(filepath, "rb") as f:
+        return PDF_HEADER in f.read(HEADER_SEARCH_SIZE)
+
+
+def _probe_with_pdfinfo(filepath, timeout):
+    """ Probe PDF with poppler's pdfinfo, which only reads the trailer, xref and page tree
+
+    Returns:
+        dict: Probe result, or None if pdfinfo is not available
+    """
+    try:
+        completed = subprocess.run(
+            ["pdfinfo", filepath],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=timeout,
+        )
+    except FileNotFoundError:
+        return None
+    except subprocess.TimeoutExpired:
+        return TIMED_OUT
+
+    if completed.returncode != 0:
+        return INVALID
+
+    info = {}
+    for line in completed.stdout.decode("utf-8", errors="replace").splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            info[key.strip()] = value.strip()
+
+    try:
+        num_pages = int(info["Pages"])
+    except (KeyError, ValueError):
+        return INVALID
+
+    return {
+        "num_pages": num_pages,
+        "encrypted": info.get("Encrypted", "no").startswith("yes"),
+        "valid": True,
+    }
+
+
+def _probe_with_pypdf2(filepath):
+    try:
+        with open(filepath, "rb") as pdf_file:
+            pdf_reader = PdfFileReader(pdf_file, strict=False)
+            encrypted = pdf_reader.isEncrypted
+            if encrypted:
+                pdf_reader.decrypt("")
+            num_pages = pdf_reader.numPages
+        return {"num_pages": num_pages, "encrypted": encrypted, "valid": True}
+    except (PyPDF2.utils.PdfReadError, OSError, KeyError, ValueError, TypeError, AssertionError, NotImplementedError):
+        return INVALID
+
+
+def _probe_with_pypdf2_timeout(filepath, timeout):
+    """ Probe PDF with PyPDF2 in a subprocess, so that it can be killed after the timeout """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+    try:
+        completed = subprocess.run(
+            [sys.executable, "-c", PYPDF2_PROBE_SCRIPT, filepath],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=timeout,
+            env=env,
+        )
+    except subprocess.TimeoutExpired:
+        return TIMED_OUT
+    if completed.returncode != 0:
+        return INVALID
+    return json.loads(completed.stdout)
+
+
+def probe_pdf(filepath, timeout=10):
+    """ Get page count, encryption and validity flags of a PDF without parsing its contents
+
+    Files without a PDF header are rejected without being parsed. Others are probed
+    with pdfinfo under a time limit, or with PyPDF2 (in a subprocess, under the same 
+    limit) if pdfinfo is not installed.
+
+    Args:
+        filepath (string): Path to PDF file
+        timeout (float): Maximum time (in seconds) allowed to probe the file
+
+    Returns:
+        dict: "num_pages" (int or None), "encrypted" (bool) and "valid" (bool). If the
+              probe timed out, "timed_out" is also set.
+    """
+    try:
+        if not _has_pdf_header(filepath):
+            return INVALID
+    except OSError:
+        return INVALID
+
+    result = _probe_with_pdfinfo(filepath, timeout)
+    if result is None:
+        result = _probe_with_pypdf2_timeout(filepath, timeout)
+    return result
+
+
+class PdfProbeCache:
+    """ Persistent table of probe results, keyed by file path, size and modification time
+
+    A file is only probed again if it changed. Probes that timed out are not cached.
+
+    Args:
+        db_path (string): Path to SQLite database
+        timeout (float): Maximum time (in seconds) allowed to probe a file
+    """
+
+    def __init__(self, db_path, timeout=10):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS probe_results ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+            "num_pages INTEGER, encrypted INTEGER, valid INTEGER)"
+        )
+        self.conn.commit()
+
+    def probe(self, filepath):
+        path = os.path.abspath(filepath)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return INVALID
+
+        row = self.conn.execute(
+            "SELECT num_pages, encrypted, valid FROM probe_results WHERE path = ? AND size = ? AND mtime = ?", 
+            (path, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row is not None:
+            return {"num_pages": row[0], "encrypted": bool(row[1]), "valid": bool(row[2])}
+
+        result = probe_pdf(path, timeout=self.timeout)
+        if result.get("timed_out"):
+            return result
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO probe_results VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                path, stat.st_size, stat.st_mtime_ns,
+                result["num_pages"], int(result["encrypted"]), int(result["valid"]),
+            ),
+        )
+        self.conn.commit()
+        return result
+
+    def close(self):
+        self.conn.close()
+
+
+_probe_caches = {}
+
+def get_probe_cache(db_path, timeout=10):
+    """ Get the probe cache stored at db_path, opened once per process and thread """
+    key = (os.getpid(), threading.get_ident(), db_path)
+    if key not in _probe_caches:
+        _probe_caches[key] = PdfProbeCache(db_path, timeout=timeout)
+    return _probe_caches[key]
+
+
+def probe_pdf_cached(filepath, db_path=None, timeout=10):
+    """ Probe PDF, using the cache stored at db_path if given """
+    if db_path is None:
+        return probe_pdf(filepath, timeout=timeout)
+    return get_probe_cache(db_path, timeout=timeout).probe(filepath)
@@ -2,20 +2,26 @@ import argparse
 import os 
 import shutil
 import natsort
-import tarfile
 import time
 from tqdm import tqdm 
 import regex as re
 from fuzzysearch import find_near_matches 
 from PIL import Image, ImageDraw
-import subprocess
 import urllib.request
 import json
 from src.utils import (
     remove_processed_from_id_list, 
     compress_dir, 
+    detect_archive_format,
+    extract_archive,
+    find_archive,
+    find_page_image,
     overwrite_dir_if_exists,
-    del_file_if_exists
+    del_file_if_exists,
+    Document,
+    open_file,
+    list_files,
+    get_doc_id,
 )
 
 
@@ -69,8 +75,8 @@ def find_abstract_span(text, abstract_text, max_l_dist=15):
 
 
 def _update_and_save_txt(in_txt_path, out_txt_path, start_stop_indices):
-    with open(out_txt_path, "w") as fw:
-        with open(in_txt_path, "r") as f:
+    with open_file(out_txt_path, "w") as fw:
+        with open_file(in_txt_path, "r") as f:
             for i, line in enumerate(f):
                 in_abstract = False 
                 for (start, stop) in start_stop_indices:
@@ -91,16 +97,15 @@ def _update_and_save_img(
     out_img_folder, 
     out_img_tar, 
 ):
-    with tarfile.open(in_img_tar) as tar:
-        tar.extractall(out_img_folder)
+    archive_format = detect_archive_format(in_img_tar)
+    extract_archive(in_img_tar, out_img_folder)
 
     doc_out_img_folder = os.path.join(out_img_folder, doc_id)
-    image_page_path = os.path.join(
-        doc_out_img_folder,
-        f"{doc_id}-{page_num}.jpg"
-    )
+    # pages may be stored as JPEG or WebP
+    image_page_path = find_page_image(doc_out_img_folder, doc_id, page_num)
     image = Image.open(image_page_path)
     draw = ImageDraw.Draw(image)
+    # pages may have been rendered to any size, so bboxes are scaled against the stored image
     img_width, img_height = image.size
     width, height = pdf_size
     scale_w = img_width / width
@@ -116,32 +121,149 @@ def _update_and_save_img(
     image.save(image_page_path)
     image.close()
 
-    compress_dir(out_img_tar, doc_out_img_folder)
-    shutil.rmtree(doc_out_img_folder)
+    if archive_format != "dir":
+        # stored in the same format as the input
+        compress_dir(out_img_tar, doc_out_img_folder, archive_format=archive_format)
+        shutil.rmtree(doc_out_img_folder)
+    elif os.path.abspath(doc_out_img_folder) != os.path.abspath(out_img_tar):
+        shutil.move(doc_out_img_folder, out_img_tar)
+
+
+def get_abstracts_to_find(item, main_lang, abstract_thresh):
+    """ Get the abstracts of a document in every language
+
+    Args:
+        item (dict): Abstract file entry 
+        main_lang (string): Main language of the dataset 
+        abstract_thresh (int): Minimum number of words in the main abstract, -1 for no minimum
+
+    Returns:
+        list: Abstracts to find, or None if the document should be skipped
+    """
+    if "abstract" in item.keys(): # only one language in dataset
+        all_abstracts = [item["abstract"]]
+        main_abstract = item["abstract"]
+    elif "abstract_" + main_lang in item.keys():
+        all_abstracts = [abstract for key, abstract in item.items() if key.startswith("abstract_")]
+        main_abstract = item["abstract_" + main_lang]
+    else:
+        return None # no abstract written in main language, skip
+
+    all_abstracts = [abstract.replace("\n", "") for abstract in all_abstracts]
+
+    if abstract_thresh > 0 and len(main_abstract.split()) < abstract_thresh:
+        print("Skipped {} (# words in abstract = {} < {})".format(
+            item["id"], len(main_abstract.split()), abstract_thresh
+        ))
+        return None
+
+    return all_abstracts
+
+
+def find_abstracts_in_pages(pages, all_abstracts, max_l_dist):
+    """ Search abstracts in pages, until all of them have been found
+
+    Args:
+        pages (iterable): (page_num, offset, text) tuples, offset being the index of 
+                          the first word of the page in the document
+        all_abstracts (list): Abstracts to find
+        max_l_dist (int): Maximum Levenshtein distance for fuzzy matching
+
+    Returns:
+        list: Whether each abstract has been found
+        list: (start, stop) word indices of each abstract in the document
+        list: Page number of each abstract
+    """
+    all_abstracts_start_stop_indices = [None for _ in all_abstracts]
+    all_abstracts_found = [False for _ in all_abstracts]
+    all_abstracts_page = [None for _ in all_abstracts]
+
+    for curr_page_num, offset, curr_text in pages:
+        for lang_idx, abstract_text in enumerate(all_abstracts):
+            abstract_start_stop_indices = find_abstract_span(
+                curr_text.lower(), abstract_text.lower(), max_l_dist
+            )
+            if abstract_start_stop_indices is not None:
+                all_abstracts_found[lang_idx] = True 
+                all_abstracts_start_stop_indices[lang_idx] = (
+                    abstract_start_stop_indices[0] + offset,
+                    abstract_start_stop_indices[1] + offset,
+                )
+                all_abstracts_page[lang_idx] = curr_page_num
+
+        if all(all_abstracts_found):
+            break 
+
+    return all_abstracts_found, all_abstracts_start_stop_indices, all_abstracts_page
+
+
+def search_abstracts(args):
+    """ Search abstracts in the outputs of convert_pdf_to_html --abstract_search, which 
+        only contain the first and last pages of each document. IDs of documents whose 
+        abstract is found are written to found_output_log, so that only these documents 
+        are fully converted.
+    """
+    fnames = sorted(os.listdir(args.abstract_search_dir))
+    fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
+    doc_ids = [fname[:-len(".json")] for fname in fnames]
+
+    if args.resume_processing:
+        print("Resuming processing...")
+        doc_ids = remove_processed_from_id_list(
+            doc_ids, args.found_output_log, args.failed_output_log
+        )
+        if not doc_ids:
+            print(f"All documents in {args.abstract_search_dir} have already been processed.")
+            return 
+
+    remaining_ids = set(doc_ids)
+
+    num_lines = sum(1 for line in open(args.abstract_path,'r'))
+
+    with open(args.abstract_path, 'r') as f:
+        for line in tqdm(f, total=num_lines, desc=f"Searching abstracts in {args.abstract_search_dir}"):
+            item = json.loads(line)
+            doc_id = item["id"]
+
+            if doc_id not in remaining_ids:
+                continue 
+            remaining_ids.remove(doc_id)
+
+            all_abstracts = get_abstracts_to_find(item, args.main_lang, args.abstract_thresh)
+            if all_abstracts is None:
+                continue
+
+            with open(os.path.join(args.abstract_search_dir, doc_id + ".json"), "r", encoding="utf-8") as fd:
+                search_doc = json.load(fd)
+            pages = (
+                (int(page_num), 0, text) 
+                for page_num, text in sorted(search_doc["pages"].items(), key=lambda page: int(page[0]))
+            )
 
+            all_abstracts_found, _, _ = find_abstracts_in_pages(pages, all_abstracts, args.max_l_dist)
 
-def count_num_pages(filepath):
-    last_line = subprocess.check_output(['tail', '-1', filepath])[:-1]
-    last_line = last_line.decode("utf-8").split("\t")
-    return int(last_line[-1])
+            log_path = args.found_output_log if all(all_abstracts_found) else args.failed_output_log
+            with open(log_path, "a") as fw:
+                fw.write(doc_id + "\n")
 
 
 def find_and_remove(args):
-    txt_fnames = sorted(os.listdir(args.text_dir))
+    txt_fnames = list_files(args.text_dir, ".txt")
     txt_fnames = txt_fnames[:args.n_docs] if args.n_docs > 0 else txt_fnames 
+    # token files may be compressed, e.g. "id.txt.gz"
+    fname_by_id = {get_doc_id(fname, ".txt"): fname for fname in txt_fnames}
 
     if args.resume_processing:
-        txt_fnames = [fname[:-len(".txt")] for fname in txt_fnames]
         print("Resuming processing...")
-        txt_fnames = remove_processed_from_id_list(
-            txt_fnames, args.found_output_log, args.failed_output_log
+        doc_ids = remove_processed_from_id_list(
+            list(fname_by_id), args.found_output_log, args.failed_output_log
         )
-        if not txt_fnames:
+        if not doc_ids:
             print(f"All documents in {args.text_dir} have already been processed.")
             return 
-        txt_fnames = [fname + ".txt" for fname in txt_fnames]
+        fname_by_id = {doc_id: fname_by_id[doc_id] for doc_id in doc_ids}
 
-    input_doc_ids = [fname.replace(".txt", "") for fname in txt_fnames]
+    input_doc_ids = fname_by_id
 
     remaining_files = input_doc_ids.copy()
 
@@ -157,88 +279,32 @@ def find_and_remove(args):
 
             if doc_id not in remaining_files:
                 print(doc_id)
-            remaining_files.remove(doc_id)
+            remaining_files.pop(doc_id)
 
-            doc_txt_path = os.path.join(args.text_dir, doc_id + ".txt")
-            doc_out_txt_path = os.path.join(args.output_text_dir, doc_id + ".txt")
+            doc_txt_path = os.path.join(args.text_dir, fname_by_id[doc_id])
+            doc_out_txt_path = os.path.join(args.output_text_dir, fname_by_id[doc_id])
             if args.img_dir is not None:
-                img_tar = os.path.join(args.img_dir, doc_id + ".tar.gz")
-                doc_out_img_tar = os.path.join(args.output_img_dir, doc_id + ".tar.gz")
+                img_tar = find_archive(args.img_dir, doc_id)
+                doc_out_img_tar = (
+                    os.path.join(args.output_img_dir, os.path.basename(img_tar)) if img_tar is not None else None
+                )
         
-            if "abstract" in item.keys(): # only one language in dataset
-                all_abstracts = [item["abstract"]]
-                main_abstract = item["abstract"]
-            elif "abstract_" + args.main_lang in item.keys():
-                all_abstracts = [abstract for key, abstract in item.items() if key.startswith("abstract_")]
-                main_abstract = item["abstract_" + args.main_lang]
-
-            else:
-                continue # no abstract written in main language, skip
-
-            all_abstracts = [abstract.replace("\n", "") for abstract in all_abstracts]
-
-            if args.abstract_thresh > 0 and len(main_abstract.split()) < args.abstract_thresh:
-                print("Skipped {} (# words in abstract = {} < {})".format(
-                    doc_id, len(main_abstract.split()), args.abstract_thresh
-                ))
-                continue 
-
-            all_abstracts_start_stop_indices = [None for _ in all_abstracts]
-            all_abstracts_found = [False for _ in all_abstracts]
-            all_abstracts_page = [None for _ in all_abstracts]
-
-            with open(doc_txt_path, 'r') as f:
-                curr_page = []
-                curr_page_num = 1
-
-                offset = 0
-
-                num_pages = count_num_pages(doc_txt_path)
-                pages_to_search = [1, 2, num_pages-1, num_pages] # we only look at the first two and last two pages
-
-                for i, line in enumerate(f):
-                    splits = line.split("\t")
-                    page_num = int(splits[-1].rstrip())
-
-                    if page_num != curr_page_num: # new page
-                        if curr_page_num in pages_to_search: 
-                            curr_text = " ".join([content[0] for content in curr_page])
-                            
-                            for lang_idx, abstract_text in enumerate(all_abstracts):
-                                abstract_start_stop_indices = find_abstract_span(
-                                    curr_text.lower(), abstract_text.lower(), args.max_l_dist
-                                )
-                                if abstract_start_stop_indices is not None:
-                                    all_abstracts_found[lang_idx] = True 
-                                    all_abstracts_start_stop_indices[lang_idx] = (
-                                        abstract_start_stop_indices[0] + offset,
-                                        abstract_start_stop_indices[1] + offset,
-                                    )
-                                    all_abstracts_page[lang_idx] = (curr_page_num, curr_page)
-                                
-                        if all(all_abstracts_found):
-                            break 
-                        else:
-                            curr_page = [splits]
-                            offset = i
-                            curr_page_num = page_num
-                    else:
-                        curr_page.append(splits)
-
-
-                if not all(all_abstracts_found): # abstract might be in the last page
-                    curr_text = " ".join([content[0] for content in curr_page])
-                    for lang_idx, abstract_text in enumerate(all_abstracts):
-                        abstract_start_stop_indices = find_abstract_span(
-                            curr_text.lower(), abstract_text.lower(), args.max_l_dist
-                        )
-                        if abstract_start_stop_indices is not None:
-                            all_abstracts_found[lang_idx] = True
-                            all_abstracts_start_stop_indices[lang_idx] = (
-                                abstract_start_stop_indices[0] + offset,
-                                abstract_start_stop_indices[1] + offset,
-                            )
-                            all_abstracts_page[lang_idx] = (curr_page_num, curr_page)
+            all_abstracts = get_abstracts_to_find(item, args.main_lang, args.abstract_thresh)
+            if all_abstracts is None:
+                continue
+
+            doc = Document(doc_txt_path)
+            num_pages = doc.num_pages
+            pages_to_search = [1, 2, num_pages-1, num_pages] # we only look at the first two and last two pages
+            pages = (
+                (page_num, start, doc.page_text(start, end)) 
+                for page_num, start, end in doc.page_spans() 
+                if page_num in pages_to_search
+            )
+
+            all_abstracts_found, all_abstracts_start_stop_indices, all_abstracts_page = find_abstracts_in_pages(
+                pages, all_abstracts, args.max_l_dist
+            )
 
             if all(all_abstracts_found):
                 _update_and_save_txt(doc_txt_path, doc_out_txt_path, all_abstracts_start_stop_indices)
@@ -251,8 +317,8 @@ def find_and_remove(args):
 
     for doc_id in tqdm(remaining_files):
         shutil.copyfile(
-            os.path.join(args.text_dir, doc_id + ".txt"), 
-            os.path.join(args.output_text_dir, doc_id + ".txt")
+            os.path.join(args.text_dir, fname_by_id[doc_id]), 
+            os.path.join(args.output_text_dir, fname_by_id[doc_id])
         )
 
 if __name__ == "__main__":
@@ -262,7 +328,6 @@ if __name__ == "__main__":
         "--text_dir",
         default=None,
         type=str,
-        required=True,
         help="The input data dir. Should contain the txt files.",
     )
     parser.add_argument(
@@ -279,7 +344,13 @@ if __name__ == "__main__":
         "--output_text_dir",
         default=None,
         type=str,
-        required=True,
+    )
+    parser.add_argument(
+        "--abstract_search_dir",
+        default=None,
+        type=str,
+        help="Directory containing the outputs of convert_pdf_to_html --abstract_search. If given, only "\
+            "log documents whose abstract is found, without removing it.",
     )
     parser.add_argument(
         "--output_img_dir",
@@ -333,25 +404,34 @@ if __name__ == "__main__":
             f"Cannot use --resume_conversion and --overwrite_output_dir at the same time."
         )
 
-    if (
-        (os.listdir(args.output_text_dir) or os.listdir(args.output_img_dir)) 
-        and not args.resume_processing
-    ):
+    if args.abstract_search_dir is not None:
         if args.overwrite_output_dir:
-            overwrite_dir_if_exists(args.output_text_dir)
-            if args.img_dir is not None: 
-                overwrite_dir_if_exists(args.output_img_dir)
             del_file_if_exists(args.found_output_log)
             del_file_if_exists(args.failed_output_log)
-        else:
-            if os.listdir(args.output_text_dir):
-                raise ValueError(
-                    f"Output directory ({args.output_text_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
-                )
-            if args.img_dir is not None and os.listdir(args.output_img_dir):
-                raise ValueError(
-                    f"Output directory ({args.output_img_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
-                )
+        search_abstracts(args)
+    else:
+        if args.text_dir is None or args.output_text_dir is None:
+            raise ValueError("--text_dir and --output_text_dir are required to remove abstracts.")
+
+        if (
+            (os.listdir(args.output_text_dir) or os.listdir(args.output_img_dir)) 
+            and not args.resume_processing
+        ):
+            if args.overwrite_output_dir:
+                overwrite_dir_if_exists(args.output_text_dir)
+                if args.img_dir is not None: 
+                    overwrite_dir_if_exists(args.output_img_dir)
+                del_file_if_exists(args.found_output_log)
+                del_file_if_exists(args.failed_output_log)
+            else:
+                if os.listdir(args.output_text_dir):
+                    raise ValueError(
+                        f"Output directory ({args.output_text_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
+                    )
+                if args.img_dir is not None and os.listdir(args.output_img_dir):
+                    raise ValueError(
+                        f"Output directory ({args.output_img_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
+                    )
             
 
-    find_and_remove(args)
\ No newline at end of file
+        find_and_remove(args)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+from collections import defaultdict
+from src.pdf_probe import probe_pdf_cached
+
+SCHEDULES = ["name", "size", "pages"]
+
+
+def estimate_cost(filepath, schedule="size", probe_cache=None):
+    """ Estimate the cost of converting a PDF
+
+    Args:
+        filepath (string): Path to PDF
+        schedule (string): "size" to use the file size, "pages" to use the probed page count
+        probe_cache (string): Path to probe cache, used if schedule is "pages"
+
+    Returns:
+        int: Estimated cost
+    """
+    if schedule == "pages":
+        probe = probe_pdf_cached(filepath, db_path=probe_cache)
+        return probe["num_pages"] or 0
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return 0
+
+
+def sort_largest_first(folder, fnames, schedule="size", probe_cache=None):
+    """ Order files so that the most expensive ones are handed out to workers first,
+        which avoids ending a run with a few large documents and idle workers
+
+    Args:
+        folder (string): Folder containing the files
+        fnames (list): File names
+        schedule (string): "name" to keep the order of fnames, "size" or "pages" to
+                           order by decreasing file size or page count
+        probe_cache (string): Path to probe cache, used if schedule is "pages"
+
+    Returns:
+        list: Ordered file names
+    """
+    if schedule == "name":
+        return fnames
+    costs = {
+        fname: estimate_cost(os.path.join(folder, fname), schedule=schedule, probe_cache=probe_cache)
+        for fname in fnames
+    }
+    return sorted(fnames, key=lambda fname: costs[fname], reverse=True)
+
+
+def run_timed(func, *args):
+    """ Run func in a worker, returning the worker ID and the time spent along with its result """
+    start = time.time()
+    result = func(*args)
+    return (os.getpid(), threading.get_ident()), time.time() - start, result
+
+
+class UtilizationTracker:
+    """ Track the time each worker spends converting documents """
+
+    def __init__(self):
+        self.start = time.time()
+        self.busy_time = defaultdict(float)
+        self.num_docs = defaultdict(int)
+
+    def record(self, worker_id, duration, num_docs=1):
+        self.busy_time[worker_id] += duration
+        self.num_docs[worker_id] += num_docs
+
+    def report(self):
+        wall_time = time.time() - self.start
+        if not self.busy_time:
+            return
+        print(f"Worker utilization (wall time: {wall_time:.1f}s)")
+        for worker_idx, worker_id in enumerate(sorted(self.busy_time)):
+            busy_time = self.busy_time[worker_id]
+            print(
+                f"\tWorker {worker_idx}: {self.num_docs[worker_id]} docs, "
+                f"busy {busy_time:.1f}s ({100 * busy_time / max(wall_time, 1e-9):.0f}%)"
+            )
+        mean_utilization = sum(self.busy_time.values()) / (len(self.busy_time) * max(wall_time, 1e-9))
+        print(f"\tMean utilization: {100 * mean_utilization:.0f}%")
@@ -4,6 +4,7 @@ import shutil
 import json 
 from datetime import datetime
 from tqdm import tqdm
+from src.utils import find_file
 
 def split(args):
     with open(args.abstract_file, 'r') as f:
@@ -33,6 +34,14 @@ def split(args):
     val_docs = sorted_docs[train_size: train_size + val_size]
     test_docs = sorted_docs[train_size + val_size:]
 
+    # find every token file before moving any, so that a missing file does not leave a partial split
+    input_paths = {}
+    for doc in sorted_docs:
+        input_path = find_file(args.input_folder, doc["id"], ".txt")
+        if input_path is None:
+            raise FileNotFoundError(f"Token file not found for {doc['id']} in {args.input_folder}")
+        input_paths[doc["id"]] = input_path
+
     train_folder = os.path.join(args.output_folder, "train")
     val_folder = os.path.join(args.output_folder, "val")
     test_folder = os.path.join(args.output_folder, "test")
@@ -41,18 +50,18 @@ def split(args):
     os.makedirs(test_folder)
 
     for doc in tqdm(train_docs, desc="Creating train split"):
-        input_path = os.path.join(args.input_folder, doc["id"] + ".txt")
-        output_path = os.path.join(train_folder, doc["id"] + ".txt")
+        input_path = input_paths[doc["id"]]
+        output_path = os.path.join(train_folder, os.path.basename(input_path))
         shutil.move(input_path, output_path)
 
     for doc in tqdm(val_docs, desc="Creating validation split"):
-        input_path = os.path.join(args.input_folder, doc["id"] + ".txt")
-        output_path = os.path.join(val_folder, doc["id"] + ".txt")
+        input_path = input_paths[doc["id"]]
+        output_path = os.path.join(val_folder, os.path.basename(input_path))
         shutil.move(input_path, output_path)
         
     for doc in tqdm(test_docs, desc="Creating test split"):
-        input_path = os.path.join(args.input_folder, doc["id"] + ".txt")
-        output_path = os.path.join(test_folder, doc["id"] + ".txt")
+        input_path = input_paths[doc["id"]]
+        output_path = os.path.join(test_folder, os.path.basename(input_path))
         shutil.move(input_path, output_path)
         
 
@@ -1,8 +1,132 @@
 import json
 import os 
+import re
+import gzip
+import hashlib
 import tarfile
+import zipfile
 import shutil
 import subprocess
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+COMPRESSION_MAGIC_BYTES = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+ARCHIVE_EXTENSIONS = {"tar.gz": ".tar.gz", "tar": ".tar", "zip": ".zip", "dir": ""}
+IMAGE_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the zstandard package (pip install zstandard).")
+    return zstandard
+
+
+def detect_compression(path):
+    """ Detect compression of a file from its magic bytes, or from its extension if it cannot be read
+
+    Returns:
+        string: "gzip", "zstd" or None
+    """
+    try:
+        with open(path, "rb") as f:
+            magic = f.read(4)
+    except OSError:
+        for compression, ext in COMPRESSION_EXTENSIONS.items():
+            if str(path).endswith(ext):
+                return compression
+        return None
+
+    for compression, magic_bytes in COMPRESSION_MAGIC_BYTES.items():
+        if magic.startswith(magic_bytes):
+            return compression
+    return None
+
+
+def open_file(path, mode="r", compression=None, encoding="utf-8"):
+    """ Open a file, transparently (de)compressing it
+
+    When reading, compression is detected from magic bytes. When writing, it is 
+    given by compression, or by the extension of path.
+
+    Args:
+        path (string): Path to file
+        mode (string): "r", "w", "a", optionally with "b" 
+        compression (string): "gzip", "zstd" or None, only used when writing
+        encoding (string): Encoding used in text mode
+
+    Returns:
+        file object
+    """
+    if "r" in mode:
+        compression = detect_compression(path)
+    elif compression is None:
+        for name, ext in COMPRESSION_EXTENSIONS.items():
+            if str(path).endswith(ext):
+                compression = name
+
+    binary = "b" in mode
+    text_encoding = None if binary else encoding
+
+    if compression is None:
+        return open(path, mode, encoding=text_encoding)
+    if not binary and "t" not in mode:
+        mode += "t"
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=6, encoding=text_encoding)
+    if compression == "zstd":
+        return _import_zstandard().open(path, mode, encoding=text_encoding)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def add_compression_ext(path, compression):
+    return path + COMPRESSION_EXTENSIONS[compression] if compression else path
+
+
+def strip_compression_ext(path):
+    for ext in COMPRESSION_EXTENSIONS.values():
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def get_doc_id(fname, ext):
+    """ Get document ID from file name, e.g. "id.txt" or "id.txt.gz" -> "id" """
+    fname = strip_compression_ext(fname)
+    return fname[:-len(ext)] if fname.endswith(ext) else fname
+
+
+def list_files(folder, ext, recursive=False):
+    """ List files with extension ext, compressed or not
+
+    Returns:
+        list: Sorted paths (file names if not recursive)
+    """
+    exts = tuple([ext] + [ext + compression_ext for compression_ext in COMPRESSION_EXTENSIONS.values()])
+    if recursive:
+        return sorted(
+            os.path.join(root, fname) 
+            for root, _, fnames in os.walk(folder) 
+            for fname in fnames if fname.endswith(exts)
+        )
+    return sorted(fname for fname in os.listdir(folder) if fname.endswith(exts))
+
+
+def find_file(folder, doc_id, ext):
+    """ Find the file of a document, compressed or not
+
+    Returns:
+        string: Path to file, or None if it does not exist
+    """
+    for compression_ext in [""] + list(COMPRESSION_EXTENSIONS.values()):
+        path = os.path.join(folder, doc_id + ext + compression_ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
 
 def del_file_if_exists(path_to_file):
     if os.path.isfile(path_to_file):
@@ -16,19 +140,74 @@ def overwrite_dir_if_exists(path_to_dir):
         os.makedirs(path_to_dir)
 
 
-def get_ids_from_arxiv_or_pubmed(input_file, limit):
+ARTICLE_ID_PATTERN = re.compile(rb'"article_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+ARTICLE_ID_SEARCH_SIZE = 1024
+SCAN_RANGE_MIN_SIZE = 64 * 1024 * 1024
+
+
+def get_article_id(line):
+    """ Get the article_id of a line of the arXiv/PubMed summarization data, without 
+        decoding the rest of the line. article_id comes first in these files, so only 
+        the beginning of the line is searched, and the line is fully parsed otherwise.
+    """
+    m = ARTICLE_ID_PATTERN.search(line, 0, ARTICLE_ID_SEARCH_SIZE)
+    if m is not None:
+        return json.loads(b'"' + m.group(1) + b'"')
+    return json.loads(line)["article_id"]
+
+
+def scan_article_ids(input_file, start=0, end=None, limit=-1):
+    """ Get the article_id of the lines starting in the byte range [start, end) of a file
+
+    Returns:
+        list: IDs
+    """
     id_list = []
-    num_processed = 0
-    with open(input_file, "r") as f:
-        for line in f:
-            item = json.loads(line)
-            id_list.append(item["article_id"])
-            num_processed += 1
-            if num_processed == limit:
+    with open(input_file, "rb") as f:
+        if start > 0:
+            # the line containing start belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            id_list.append(get_article_id(line))
+            if len(id_list) == limit:
                 break
-    
     return id_list
 
+
+def get_ids_from_arxiv_or_pubmed(input_file, limit, num_workers=None):
+    """ Get the IDs of the articles in the arXiv/PubMed summarization data
+
+    Args:
+        input_file (string): Path to JSONL file
+        limit (int): Maximum number of IDs, -1 for no limit
+        num_workers (int): Number of processes scanning byte ranges of the file, if there is 
+                           no limit. By default, one per 64MB, up to the number of CPUs.
+
+    Returns:
+        list: IDs, in the order of the file
+    """
+    if limit > 0:
+        return scan_article_ids(input_file, limit=limit)
+
+    file_size = os.path.getsize(input_file)
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, file_size // SCAN_RANGE_MIN_SIZE + 1)
+    if num_workers <= 1:
+        return scan_article_ids(input_file)
+
+    bounds = [file_size * i // num_workers for i in range(num_workers + 1)]
+    with Pool(num_workers) as pool:
+        id_lists = pool.starmap(
+            partial(scan_article_ids, input_file), zip(bounds[:-1], bounds[1:])
+        )
+    return [article_id for id_list in id_lists for article_id in id_list]
+
 def extract_pdf(url, output_path):
     """ Extract PDF based on URL
 
@@ -80,16 +259,238 @@ def remove_processed_from_id_list(id_list, processed_log, failed_log=None):
     return id_list
 
 
-def compress_dir(tar_path, output_folder):
-    with tarfile.open(tar_path, "w:gz") as tar:
-        tar.add(
-            output_folder, 
-            arcname=os.path.basename(output_folder)
-        ) 
+def get_file_hash(path, chunk_size=1 << 20):
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_file_signature(path, previous=None):
+    """ Get size, modification time and hash of a file
+
+    Args:
+        path (string): Path to file
+        previous (dict): Previously computed signature of the file. If size and 
+                         modification time did not change, its hash is reused.
+
+    Returns:
+        dict: Signature of the file 
+    """
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if (
+        previous is not None 
+        and previous.get("size") == signature["size"] 
+        and previous.get("mtime") == signature["mtime"]
+    ):
+        signature["hash"] = previous["hash"]
+    else:
+        signature["hash"] = get_file_hash(path)
+    return signature
+
+
+def load_records(log_path):
+    """ Load an append-only log of JSON records, one per line, keyed by their "id" field
+
+    Later records override earlier ones, and records with "removed" set delete the 
+    previous record with the same ID, so that the log can be appended to while 
+    processing. Lines left incomplete by an interrupted write are skipped.
+
+    Returns:
+        dict: Mapping from ID to its latest record
+    """
+    records = {}
+    if not os.path.isfile(log_path):
+        return records
+    with open(log_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError: # interrupted write
+                continue
+            if record.get("removed"):
+                records.pop(record["id"], None)
+            else:
+                records[record["id"]] = record
+    return records
+
+
+def append_record(log_path, record):
+    with open(log_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def compact_records(log_path, records):
+    """ Rewrite a log with only the latest record of each ID, sorted by ID """
+    tmp_path = log_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for record_id in sorted(records):
+            f.write(json.dumps(records[record_id]) + "\n")
+    os.replace(tmp_path, log_path)
+
+
+def compress_dir(tar_path, output_folder, archive_format="tar.gz"):
+    """ Archive a folder. Members are stored under the name of the folder
+
+    Args:
+        tar_path (string): Path to archive
+        output_folder (string): Folder to archive
+        archive_format (string): "tar.gz", "tar", "zip" (entries are stored without 
+                                 compression) or "dir" (folder is copied to tar_path)
+    """
+    arcname = os.path.basename(output_folder)
+    if archive_format == "tar.gz":
+        with tarfile.open(tar_path, "w:gz") as tar:
+            tar.add(output_folder, arcname=arcname) 
+    elif archive_format == "tar":
+        with tarfile.open(tar_path, "w") as tar:
+            tar.add(output_folder, arcname=arcname) 
+    elif archive_format == "zip":
+        with zipfile.ZipFile(tar_path, "w", compression=zipfile.ZIP_STORED) as zf:
+            for root, _, fnames in os.walk(output_folder):
+                for fname in sorted(fnames):
+                    path = os.path.join(root, fname)
+                    zf.write(path, arcname=os.path.join(arcname, os.path.relpath(path, output_folder)))
+    elif archive_format == "dir":
+        if os.path.abspath(tar_path) != os.path.abspath(output_folder):
+            shutil.copytree(output_folder, tar_path)
+    else:
+        raise ValueError(f"Unknown archive format: {archive_format}")
+
+
+def get_page_image_name(doc_id, page_num, image_format="jpeg"):
+    return f"{doc_id}-{page_num}{IMAGE_EXTENSIONS[image_format]}"
+
+
+def find_page_image(folder, doc_id, page_num):
+    """ Find the image of a page, whatever its format
+
+    Returns:
+        string: Path to image, or None if it does not exist
+    """
+    for image_format in IMAGE_EXTENSIONS:
+        path = os.path.join(folder, get_page_image_name(doc_id, page_num, image_format))
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def get_archive_path(folder, doc_id, archive_format):
+    return os.path.join(folder, doc_id + ARCHIVE_EXTENSIONS[archive_format])
+
+
+def find_archive(folder, doc_id):
+    """ Find the page images of a document, whatever their archive format
+
+    Returns:
+        string: Path to archive (or folder), or None if it does not exist
+    """
+    for archive_format, ext in ARCHIVE_EXTENSIONS.items():
+        path = os.path.join(folder, doc_id + ext)
+        if (os.path.isdir(path) if archive_format == "dir" else os.path.isfile(path)):
+            return path
+    return None
+
+
+def detect_archive_format(path):
+    """ Detect the format of an archive from its contents
+
+    Returns:
+        string: "tar.gz", "tar", "zip" or "dir"
+    """
+    if os.path.isdir(path):
+        return "dir"
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(COMPRESSION_MAGIC_BYTES["gzip"]):
+        return "tar.gz"
+    if magic.startswith(b"PK\x03\x04"):
+        return "zip"
+    if tarfile.is_tarfile(path):
+        return "tar"
+    raise ValueError(f"Unknown archive format: {path}")
+
+
+def extract_archive(path, output_folder):
+    """ Extract an archive created by compress_dir into output_folder """
+    archive_format = detect_archive_format(path)
+    if archive_format == "dir":
+        shutil.copytree(path, os.path.join(output_folder, os.path.basename(path)), dirs_exist_ok=True)
+    elif archive_format == "zip":
+        with zipfile.ZipFile(path) as zf:
+            zf.extractall(output_folder)
+    else:
+        with tarfile.open(path) as tar:
+            tar.extractall(output_folder)
+
+
+def read_archive_member(path, member):
+    """ Read a single file from an archive created by compress_dir
+
+    Args:
+        path (string): Path to archive
+        member (string): Name of the file in the archive, e.g. "id/id-1.jpg"
+
+    Returns:
+        bytes: File contents
+    """
+    archive_format = detect_archive_format(path)
+    if archive_format == "dir":
+        with open(os.path.join(os.path.dirname(os.path.normpath(path)), member), "rb") as f:
+            return f.read()
+    if archive_format == "zip":
+        with zipfile.ZipFile(path) as zf:
+            return zf.read(member)
+    with tarfile.open(path) as tar:
+        return tar.extractfile(member).read()
+
+
+def list_archive_members(path):
+    """ List the files of an archive created by compress_dir, named as in read_archive_member """
+    archive_format = detect_archive_format(path)
+    if archive_format == "dir":
+        root = os.path.dirname(os.path.normpath(path))
+        return sorted(
+            os.path.relpath(os.path.join(folder, fname), root) 
+            for folder, _, fnames in os.walk(path) for fname in fnames
+        )
+    if archive_format == "zip":
+        with zipfile.ZipFile(path) as zf:
+            return sorted(name for name in zf.namelist() if not name.endswith("/"))
+    with tarfile.open(path) as tar:
+        return sorted(member.name for member in tar.getmembers() if member.isfile())
+
+
+def iter_archive_members(path):
+    """ Read every file of an archive created by compress_dir, opening it only once
+
+    Yields:
+        tuple: Member name (as in read_archive_member) and file contents
+    """
+    archive_format = detect_archive_format(path)
+    if archive_format == "dir":
+        root = os.path.dirname(os.path.normpath(path))
+        for member in list_archive_members(path):
+            with open(os.path.join(root, member), "rb") as f:
+                yield member, f.read()
+    elif archive_format == "zip":
+        with zipfile.ZipFile(path) as zf:
+            for name in zf.namelist():
+                if not name.endswith("/"):
+                    yield name, zf.read(name)
+    else:
+        with tarfile.open(path, "r|*") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member).read()
 
 def get_doc_content(doc_path):
     doc_content = []
-    with open(doc_path, 'r') as f:
+    with open_file(doc_path, 'r') as f:
         for line in f:
             content = line.split("\t")
             word = content[0]
@@ -100,6 +501,151 @@ def get_doc_content(doc_path):
 
     return doc_content
 
+class Document:
+    """ Lazy reader for token files written by parse_html
+
+    Each line of a token file contains a word, its bbox, the page size and
+    the page number, separated by tabs. The file is only read when word-level
+    contents are accessed; counts are computed without parsing lines.
+
+    Args:
+        path (string): Path to token file
+    """
+
+    __slots__ = ("path", "_words", "_bboxes", "_page_sizes", "_page_numbers")
+
+    NUM_FIELDS = 8
+
+    def __init__(self, path):
+        self.path = path
+        self._words = None
+        self._bboxes = None
+        self._page_sizes = None
+        self._page_numbers = None
+
+    def _load(self):
+        with open_file(self.path, "r") as f:
+            content = f.read()
+        if content.endswith("\n"):
+            content = content[:-1]
+        if not content:
+            self._words = []
+            self._bboxes = np.zeros((0, 4), dtype=np.int32)
+            self._page_sizes = np.zeros((0, 2), dtype=np.int32)
+            self._page_numbers = np.zeros(0, dtype=np.int32)
+            return
+
+        fields = content.replace("\n", "\t").split("\t")
+        if len(fields) % self.NUM_FIELDS != 0:
+            raise ValueError(f"{self.path} is not a valid token file.")
+
+        columns = [
+            np.array(fields[i::self.NUM_FIELDS]).astype(np.int32) for i in range(1, self.NUM_FIELDS)
+        ]
+        self._words = fields[0::self.NUM_FIELDS]
+        self._bboxes = np.stack(columns[:4], axis=1)
+        self._page_sizes = np.stack(columns[4:6], axis=1)
+        self._page_numbers = columns[6]
+
+    @property
+    def words(self):
+        if self._words is None:
+            self._load()
+        return self._words
+
+    @property
+    def bboxes(self):
+        """ np.ndarray: (num_words, 4) array of xmin, ymin, xmax, ymax """
+        if self._bboxes is None:
+            self._load()
+        return self._bboxes
+
+    @property
+    def page_sizes(self):
+        """ np.ndarray: (num_words, 2) array of page width, page height """
+        if self._page_sizes is None:
+            self._load()
+        return self._page_sizes
+
+    @property
+    def page_numbers(self):
+        if self._page_numbers is None:
+            self._load()
+        return self._page_numbers
+
+    @property
+    def num_words(self):
+        if self._words is not None:
+            return len(self._words)
+        num_lines = 0
+        last_char = b"\n"
+        with open_file(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                num_lines += chunk.count(b"\n")
+                last_char = chunk[-1:]
+        if last_char != b"\n": # last line without trailing newline
+            num_lines += 1
+        return num_lines
+
+    @property
+    def num_pages(self):
+        """ int: Page number of the last word (pages are numbered from 1) """
+        if self._page_numbers is not None:
+            return int(self._page_numbers[-1]) if len(self._page_numbers) else 0
+        if detect_compression(self.path) is not None:
+            return self._num_pages_from_stream()
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            block_size = 1024
+            while True:
+                start = max(0, end - block_size)
+                f.seek(start)
+                tail = f.read(end - start).rstrip(b"\n")
+                if b"\n" in tail or start == 0:
+                    break
+                block_size *= 2
+        last_line = tail.rsplit(b"\n", 1)[-1]
+        if not last_line:
+            return 0
+        return int(last_line.rsplit(b"\t", 1)[-1])
+
+    def _num_pages_from_stream(self):
+        # compressed files cannot be read backwards, keep the end of the decompressed stream
+        tail = b""
+        with open_file(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                tail = (tail + chunk)[-(1 << 16):]
+        last_line = tail.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+        if not last_line:
+            return 0
+        return int(last_line.rsplit(b"\t", 1)[-1])
+
+    def page_spans(self):
+        """ Yield (page_number, start, end) so that words[start:end] are the words of the page """
+        page_numbers = self.page_numbers
+        if len(page_numbers) == 0:
+            return
+        boundaries = np.flatnonzero(np.diff(page_numbers)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(page_numbers)]))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield int(page_numbers[start]), start, end
+
+    def pages(self):
+        """ Yield (page_number, words, bboxes, page_size) for each page """
+        for page_number, start, end in self.page_spans():
+            yield (
+                page_number,
+                self.words[start:end],
+                self.bboxes[start:end],
+                tuple(self.page_sizes[start].tolist()),
+            )
+
+    def page_text(self, start, end):
+        return " ".join(self.words[start:end])
+
+
 def get_abstract(abstract_path, doc_id):
     with open(abstract_path, "r", encoding="utf-8") as f:
         for line in f:
@@ -0,0 +1,82 @@
+import os
+import stat
+
+import pytest
+
+from src.convert_pdf_to_html import CONVERTED, CRASHED, DockerWorkers
+
+
+# Stand-in for docker: containers are files recording the mounted folder, and 
+# containers listed in $DEAD_CONTAINERS fail every exec
+FAKE_DOCKER = """#!/bin/sh
+state={state}
+cmd=$1; shift
+case $cmd in
+  run) while [ $# -gt 0 ]; do case $1 in -v) case $2 in *:/pdf) mnt=${{2%:/pdf}};; esac; shift;; esac; shift; done
+       n=$(($(cat $state/.count 2>/dev/null || echo 0) + 1)); echo $n > $state/.count
+       id=cid$n; echo "$mnt" > $state/$id; echo $id;;
+  exec) id=$1; shift
+        case " $DEAD_CONTAINERS " in *" $id "*) exit 1;; esac
+        [ -f $state/$id ] || exit 1
+        cd "$(cat $state/$id)" && exec "$@";;
+  rm) shift; for id; do rm -f $state/$id; done;;
+esac
+"""
+
+FAKE_PDFTOTEXT = """#!/bin/sh
+for last; do :; done
+echo "<html/>" > "$last"
+"""
+
+
+def _write_executable(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def fake_docker(tmp_path, monkeypatch):
+    state = tmp_path / "containers"
+    state.mkdir()
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    _write_executable(bin_dir / "docker", FAKE_DOCKER.format(state=state))
+    _write_executable(bin_dir / "pdftotext", FAKE_PDFTOTEXT)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    input_dir = tmp_path / "input"
+    (input_dir / "pdf").mkdir(parents=True)
+    (input_dir / "html").mkdir()
+    return str(bin_dir / "docker"), input_dir
+
+
+def _get_pairs(input_dir, num_pdfs):
+    pairs = []
+    for i in range(num_pdfs):
+        (input_dir / "pdf" / f"doc{i}.pdf").write_bytes(b"%PDF-")
+        pairs.append((f"pdf/doc{i}.pdf", f"html/doc{i}.html"))
+    return pairs
+
+
+def test_dead_container_is_replaced(fake_docker, monkeypatch):
+    docker_cmd, input_dir = fake_docker
+    monkeypatch.setenv("DEAD_CONTAINERS", "cid1")
+    pairs = _get_pairs(input_dir, 8)
+
+    with DockerWorkers(str(input_dir), 1, docker_cmd=docker_cmd) as workers:
+        statuses = workers.convert_batch(pairs, 1, timeout=2)
+
+    assert statuses == [CONVERTED] * len(pairs)
+    assert sorted(os.listdir(input_dir / "html")) == sorted(f"doc{i}.html" for i in range(len(pairs)))
+
+
+def test_containers_failing_on_a_pdf_mark_it_as_crashed(fake_docker, monkeypatch):
+    docker_cmd, input_dir = fake_docker
+    monkeypatch.setenv("DEAD_CONTAINERS", " ".join(f"cid{i}" for i in range(1, 10)))
+    pairs = _get_pairs(input_dir, 2)
+
+    with DockerWorkers(str(input_dir), 1, docker_cmd=docker_cmd) as workers:
+        statuses = workers.convert_batch(pairs, 1, timeout=2)
+
+    assert statuses == [CRASHED] * len(pairs)